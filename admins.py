@@ -0,0 +1,74 @@
+import time
+import asyncio
+import logging
+from pyrogram import Client, filters
+from pyrogram.types import ChatMemberUpdated
+from config import ADMIN_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = ("administrator", "creator", "owner")
+
+def is_admin_status(member):
+    # Pyrogram 1.x reports statuses as strings, 2.x as enums with the same values
+    return member is not None and getattr(member.status, 'value', member.status) in ADMIN_STATUSES
+
+class AdminCache:
+    # chat_id -> (expires_at, {user_id: User}); concurrent misses for a chat share one fetch
+    def __init__(self, ttl=ADMIN_CACHE_TTL):
+        self.ttl = ttl
+        self.chats = {}
+        self.fetches = {}
+        self.hits = self.misses = 0
+
+    async def get(self, client, chat_id):
+        entry = self.chats.get(chat_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        fetch = self.fetches.get(chat_id)
+        if fetch is None:
+            fetch = asyncio.ensure_future(self.fetch(client, chat_id))
+            self.fetches[chat_id] = fetch
+            fetch.add_done_callback(lambda task: self.fetch_done(chat_id, task))
+        return await asyncio.shield(fetch)
+
+    async def fetch(self, client, chat_id):
+        admins = {}
+        async for member in client.iter_chat_members(chat_id, filter="administrators"):
+            admins[member.user.id] = member.user
+        # An invalidation during the fetch means the list may already be stale
+        if self.fetches.get(chat_id) is asyncio.current_task():
+            self.chats[chat_id] = (time.monotonic() + self.ttl, admins)
+        return admins
+
+    def fetch_done(self, chat_id, task):
+        if self.fetches.get(chat_id) is task:
+            del self.fetches[chat_id]
+
+    async def is_admin(self, client, chat_id, user_id):
+        return user_id in await self.get(client, chat_id)
+
+    def invalidate(self, chat_id):
+        self.chats.pop(chat_id, None)
+        self.fetches.pop(chat_id, None)
+
+admin_cache = AdminCache()
+
+def admin_only():
+    async def func(_, client, message):
+        if not message.from_user:
+            return False
+        try:
+            return await admin_cache.is_admin(client, message.chat.id, message.from_user.id)
+        except Exception as e:
+            logger.error(f"Admin check error: {e}")
+            return False
+    return filters.create(func)
+
+def register_admin_handlers(client: Client):
+    @client.on_chat_member_updated(filters.group)
+    async def admin_changed(_, update: ChatMemberUpdated):
+        if is_admin_status(update.old_chat_member) or is_admin_status(update.new_chat_member):
+            admin_cache.invalidate(update.chat.id)
@@ -1,46 +1,273 @@
 import re
+import json
+import time
+import hashlib
 import aiohttp
 import asyncio
 import logging
-from config import DEEPSEEK_API_KEY
+from limiter import AdaptiveLimiter, INTERACTIVE, BACKGROUND
+from config import (DEEPSEEK_API_KEY, DEEPSEEK_URL, DEEPSEEK_CONNECTIONS, DEEPSEEK_KEEPALIVE, DEEPSEEK_DNS_TTL,
+                    DEEPSEEK_CONNECT_TIMEOUT, DEEPSEEK_READ_TIMEOUT, ASK_STREAM_EDIT_INTERVAL,
+                    TOXICITY_BATCH_SIZE, TOXICITY_BATCH_WAIT_MS)
 
 logger = logging.getLogger(__name__)
 
-api_semaphore = asyncio.Semaphore(5)
+ai_limiter = AdaptiveLimiter()
 
-async def ask_deepseek(question):
-    async with api_semaphore:
-        url = "https://api.deepseek.com/v1/chat/completions"
-        headers = {
+API_STATUS_ERROR = "Sorry, I couldn't process your question."
+API_ERROR = "AI service error."
+
+ASK_PARAMS = {"model": "deepseek-chat", "max_tokens": 500, "temperature": 0.7}
+
+class DeepSeekClient:
+    # One long-lived session, so requests reuse warm keep-alive connections instead of a new TCP/TLS handshake each
+    def __init__(self, url=DEEPSEEK_URL, connections=DEEPSEEK_CONNECTIONS, keepalive=DEEPSEEK_KEEPALIVE,
+                 dns_ttl=DEEPSEEK_DNS_TTL, connect_timeout=DEEPSEEK_CONNECT_TIMEOUT, read_timeout=DEEPSEEK_READ_TIMEOUT):
+        self.url = url
+        self.connections = connections
+        self.keepalive = keepalive
+        self.dns_ttl = dns_ttl
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self.session = None
+
+    def start(self):
+        connector = aiohttp.TCPConnector(limit=self.connections, keepalive_timeout=self.keepalive,
+                                         ttl_dns_cache=self.dns_ttl)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, headers={
             "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
             "Content-Type": "application/json"
+        })
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def post(self, payload):
+        # Opened lazily for scripts that call the API without going through init_bot
+        if self.session is None or self.session.closed:
+            self.start()
+        return self.session.post(self.url, json=payload)
+
+deepseek = DeepSeekClient()
+
+class SingleFlight:
+    # Concurrent calls with the same key await one shared call; a cancelled waiter leaves it running for the rest
+    def __init__(self):
+        self.calls = {}
+        self.started = self.coalesced = 0
+
+    async def do(self, key, fn, *args):
+        call = self.calls.get(key)
+        if call is None:
+            self.started += 1
+            call = asyncio.ensure_future(fn(*args))
+            self.calls[key] = call
+            call.add_done_callback(lambda done: self.call_done(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(call)
+
+    def call_done(self, key, call):
+        if self.calls.get(key) is call:
+            del self.calls[key]
+
+    def stats(self):
+        total = self.started + self.coalesced
+        return {
+            'calls': total,
+            'coalesced': self.coalesced,
+            'in_flight': len(self.calls),
+            'coalesced_ratio': self.coalesced / total if total else 0.0,
         }
-        payload = {
-            "model": "deepseek-chat",
-            "messages": [{"role": "user", "content": question}],
-            "max_tokens": 500,
-            "temperature": 0.7
-        }
+
+ai_flights = SingleFlight()
+# question -> on_text callbacks of every caller sharing that stream
+stream_listeners = {}
+
+async def ask_deepseek(question, chat_id=None, lane=BACKGROUND):
+    # Forwarded spam and trending questions arrive as bursts of identical prompts
+    return await ai_flights.do(("ask", question), _ask_deepseek, question, chat_id, lane)
+
+async def _ask_deepseek(question, chat_id, lane):
+    async with ai_limiter.slot(chat_id, lane) as slot:
+        payload = {**ASK_PARAMS, "messages": [{"role": "user", "content": question}]}
         try:
-            async with aiohttp.ClientSession().post(url, json=payload, headers=headers) as response:
+            async with deepseek.post(payload) as response:
+                slot.record(response.status)
                 if response.status == 200:
                     data = await response.json()
                     logger.info(f"DeepSeek API success: {question[:50]}...")
                     return data['choices'][0]['message']['content'].strip()
                 logger.error(f"DeepSeek API status {response.status}")
-                return "Sorry, I couldn't process your question."
+                return API_STATUS_ERROR
         except Exception as e:
+            slot.record(None)
             logger.error(f"DeepSeek API error: {e}")
-            return "AI service error."
+            return API_ERROR
 
-async def is_toxic_message(message_text):
+async def stream_deepseek(question, on_text, chat_id=None, interval=ASK_STREAM_EDIT_INTERVAL):
+    # Server-sent events: on_text(partial) is awaited for the first tokens, then at most once per interval;
+    # the caller shows the returned full answer. Callers joining an identical stream get its later updates.
+    listeners = stream_listeners.setdefault(question, [])
+    listeners.append(on_text)
+    try:
+        return await ai_flights.do(("stream", question), _stream_deepseek, question, listeners, chat_id, interval)
+    finally:
+        listeners.remove(on_text)
+        if not listeners and stream_listeners.get(question) is listeners:
+            del stream_listeners[question]
+
+async def _stream_deepseek(question, listeners, chat_id, interval):
+    async with ai_limiter.slot(chat_id, INTERACTIVE) as slot:
+        payload = {**ASK_PARAMS, "messages": [{"role": "user", "content": question}], "stream": True}
+        parts = []
+        shown_at = None
+        try:
+            async with deepseek.post(payload) as response:
+                slot.record(response.status)
+                if response.status != 200:
+                    logger.error(f"DeepSeek API status {response.status}")
+                    return API_STATUS_ERROR
+                async for line in response.content:
+                    line = line.decode().strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        logger.info(f"DeepSeek API stream success: {question[:50]}...")
+                        return ''.join(parts).strip() or API_STATUS_ERROR
+                    delta = json.loads(data)['choices'][0]['delta'].get('content')
+                    if not delta:
+                        continue
+                    parts.append(delta)
+                    now = time.monotonic()
+                    if shown_at is None or now - shown_at >= interval:
+                        shown_at = now
+                        partial = ''.join(parts)
+                        await asyncio.gather(*(listener(partial) for listener in list(listeners)))
+            # The stream closed without [DONE]; a truncated answer must not be shown or cached as complete
+            logger.error(f"DeepSeek API stream ended early after {len(parts)} chunks: {question[:50]}...")
+            return API_ERROR
+        except Exception as e:
+            slot.record(None)
+            logger.error(f"DeepSeek API stream error: {e}")
+            return API_ERROR
+
+def ask_cache_key(question, params=ASK_PARAMS):
+    # Case, spacing and trailing punctuation don't change the question; a change of model or sampling does
+    question = ' '.join(sanitize_input(question).casefold().split()).rstrip('.,!? ')
+    return hashlib.blake2b(json.dumps([question, params], sort_keys=True).encode(), digest_size=16).hexdigest()
+
+async def is_toxic_message(message_text, chat_id=None):
     prompt = f"Is the following text toxic, inappropriate, or offensive? Respond with 'Yes' or 'No':\n{message_text}"
-    response = await ask_deepseek(prompt)
-    return response.strip().lower() == "yes"
+    response = (await ask_deepseek(prompt, chat_id)).strip().lower().rstrip('.')
+    # None when the API failed or gave no verdict, so callers don't cache it
+    if response in ("yes", "no"):
+        return response == "yes"
+    return None
+
+BATCH_ANSWER = re.compile(r'^\W*(\d+)\W+(yes|no)\b', re.IGNORECASE | re.MULTILINE)
+
+def build_batch_prompt(texts):
+    # JSON-quoting keeps every message on its own numbered line
+    lines = "\n".join(f"{i}. {json.dumps(text, ensure_ascii=False)}" for i, text in enumerate(texts, 1))
+    return (
+        "For each numbered message below, decide whether it is toxic, inappropriate, or offensive. "
+        "Answer with exactly one line per message in the form '<number>: Yes' or '<number>: No' and nothing else.\n"
+        f"{lines}"
+    )
+
+def parse_batch_response(response, count):
+    verdicts = {}
+    for number, answer in BATCH_ANSWER.findall(response):
+        index = int(number)
+        if not 1 <= index <= count or index in verdicts:
+            return None
+        verdicts[index] = answer.lower() == "yes"
+    if len(verdicts) != count:
+        return None
+    return [verdicts[i] for i in range(1, count + 1)]
+
+class ToxicityBatcher:
+    # Collects concurrent checks for up to max_wait seconds (or max_batch messages) into one API request
+    def __init__(self, max_batch=TOXICITY_BATCH_SIZE, max_wait=TOXICITY_BATCH_WAIT_MS / 1000):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+        self.requests = self.items = self.fallbacks = 0
+
+    async def classify(self, text, chat_id=None):
+        if self.max_batch <= 1:
+            return await is_toxic_message(text, chat_id)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, chat_id, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self.run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch):
+        # Callers that were cancelled while waiting drop out of the batch
+        batch = [(text, chat_id, future) for text, chat_id, future in batch if not future.done()]
+        if not batch:
+            return
+        self.requests += 1
+        self.items += len(batch)
+        # A batch is only attributed to a chat for fair scheduling when every message came from it
+        chats = {chat_id for _, chat_id, _ in batch}
+        chat_id = chats.pop() if len(chats) == 1 else None
+        try:
+            if len(batch) == 1:
+                verdicts = [await is_toxic_message(batch[0][0], chat_id)]
+            else:
+                response = await ask_deepseek(build_batch_prompt([text for text, _, _ in batch]), chat_id)
+                if response in (API_STATUS_ERROR, API_ERROR):
+                    verdicts = [None] * len(batch)
+                else:
+                    verdicts = parse_batch_response(response, len(batch))
+                if verdicts is None:
+                    logger.warning(f"Unparseable batch verdict for {len(batch)} messages, falling back to single checks")
+                    self.fallbacks += 1
+                    self.requests += len(batch)
+                    verdicts = await asyncio.gather(*(is_toxic_message(text, chat_id) for text, chat_id, _ in batch))
+        except Exception as e:
+            logger.error(f"Toxicity batch error: {e}")
+            verdicts = [None] * len(batch)
+        for (_, _, future), toxic in zip(batch, verdicts):
+            if not future.done():
+                future.set_result(toxic)
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'messages': self.items,
+            'fallbacks': self.fallbacks,
+            'batch_size': self.items / self.requests if self.requests else 0.0,
+        }
+
+toxicity_batcher = ToxicityBatcher()
 
-async def generate_welcome_message(username):
-    prompt = f"Generate a friendly, casual welcome message in Hindi for a user named {username}. Include a fun tone and emojis."
-    return await ask_deepseek(prompt)
+async def generate_welcome_template(language):
+    prompt = (f"Generate a friendly, casual welcome message in {language} for new group members. "
+              "Write {name} exactly where their names go. Include a fun tone and emojis. Reply with the message only.")
+    response = (await ask_deepseek(prompt)).strip()
+    # Templates without the placeholder (or API errors) would greet nobody
+    return response if "{name}" in response else None
 
 def is_hindi(text):
     return bool(re.search(r'[\u0900-\u097F]', text))
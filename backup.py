@@ -0,0 +1,52 @@
+import os
+import glob
+import gzip
+import time
+import shutil
+import asyncio
+import logging
+from datetime import datetime
+from config import BACKUP_DIR, BACKUP_INTERVAL, BACKUP_KEEP, BACKUP_PAGES, BACKUP_SLEEP
+
+logger = logging.getLogger(__name__)
+
+backup_lock = asyncio.Lock()
+
+def compress_file(src, dst):
+    with open(src, 'rb') as f_in, gzip.open(dst, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(src)
+
+def rotate_backups(directory, keep):
+    backups = sorted(glob.glob(os.path.join(directory, "group_manager-*.db.gz")))
+    expired = backups[:-keep] if keep > 0 else []
+    for path in expired:
+        os.remove(path)
+    return len(expired)
+
+async def run_backup(storage, directory=BACKUP_DIR, keep=BACKUP_KEEP):
+    async with backup_lock:
+        os.makedirs(directory, exist_ok=True)
+        raw_path = os.path.join(directory, f"group_manager-{datetime.now():%Y%m%d-%H%M%S-%f}.db")
+        started = time.perf_counter()
+        await storage.backup(raw_path, BACKUP_PAGES, BACKUP_SLEEP)
+        raw_size = os.path.getsize(raw_path)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, compress_file, raw_path, raw_path + ".gz")
+        report = {
+            'path': raw_path + ".gz",
+            'raw_size': raw_size,
+            'size': os.path.getsize(raw_path + ".gz"),
+            'duration': time.perf_counter() - started,
+            'rotated': rotate_backups(directory, keep),
+        }
+    logger.info(f"Backup written to {report['path']}: {report['raw_size']} -> {report['size']} bytes in {report['duration']:.2f}s")
+    return report
+
+async def backup_loop(storage, interval=BACKUP_INTERVAL):
+    while interval > 0:
+        await asyncio.sleep(interval)
+        try:
+            await run_backup(storage)
+        except Exception as e:
+            logger.error(f"Backup error: {e}")
@@ -0,0 +1,91 @@
+import csv
+import io
+import math
+import time
+import logging
+from config import GLOBAL_BAN_CAPACITY, GLOBAL_BAN_FP_RATE
+
+logger = logging.getLogger(__name__)
+
+MASK = (1 << 64) - 1
+
+class BloomFilter:
+    def __init__(self, capacity=GLOBAL_BAN_CAPACITY, fp_rate=GLOBAL_BAN_FP_RATE):
+        self.size = max(8, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        # Double hashing over two 64-bit mixes of the integer key, generated lazily
+        h1 = (key * 0x9E3779B97F4A7C15) & MASK
+        h2 = ((key ^ (key >> 31)) * 0xBF58476D1CE4E5B9 & MASK) | 1
+        size = self.size
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % size
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        # Most negatives stop at the first probe
+        bits = self.bits
+        for position in self.positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+class GlobalBanList:
+    # The Bloom filter answers "not banned" without touching the database; positives are confirmed there.
+    # Removed users stay in the filter until the next rebuild, which only costs a confirming lookup.
+    def __init__(self, capacity=GLOBAL_BAN_CAPACITY, fp_rate=GLOBAL_BAN_FP_RATE):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.bloom = BloomFilter(capacity, fp_rate)
+        self.checks = self.confirmed = self.false_positives = 0
+
+    async def load(self, storage):
+        bloom = BloomFilter(self.capacity, self.fp_rate)
+        for user_id in await storage.get_global_ban_ids():
+            bloom.add(user_id)
+        self.bloom = bloom
+        logger.info(f"Loaded {bloom.count} global bans")
+
+    async def is_banned(self, storage, user_id):
+        self.checks += 1
+        if user_id not in self.bloom:
+            return False
+        if await storage.is_globally_banned(user_id):
+            self.confirmed += 1
+            return True
+        self.false_positives += 1
+        return False
+
+    async def add(self, storage, entries):
+        # entries: (user_id, reason, banned_by) tuples
+        now = time.time()
+        entries = [(user_id, reason, banned_by, now) for user_id, reason, banned_by in entries]
+        await storage.add_global_bans(entries)
+        for user_id, *_ in entries:
+            self.bloom.add(user_id)
+        return len(entries)
+
+    async def remove(self, storage, user_id):
+        return await storage.remove_global_ban(user_id)
+
+def parse_ban_list(text, banned_by):
+    # One "user_id[,reason]" per line; headers and malformed lines are skipped
+    entries = []
+    for row in csv.reader(io.StringIO(text)):
+        if row and row[0].strip().lstrip('-').isdigit():
+            entries.append((int(row[0]), row[1].strip() if len(row) > 1 else "Imported", banned_by))
+    return entries
+
+def format_ban_list(bans):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["user_id", "reason", "banned_by", "banned_at"])
+    writer.writerows(bans)
+    return out.getvalue()
@@ -0,0 +1,205 @@
+import os
+import time
+import asyncio
+import random
+import tempfile
+import logging
+import tracemalloc
+from collections import defaultdict
+from database import Database
+from storage import SQLiteStorage, MemoryStorage
+from flood import FloodLimiter
+from matcher import AutoReplyMatcher
+from toxicity import ToxicityPrefilter
+from spam import SpamIndex
+from config import SPAM_MIN_TOKENS
+from limiter import AdaptiveLimiter, INTERACTIVE, BACKGROUND
+from unittest import mock
+import ai
+
+logging.disable(logging.CRITICAL)
+
+async def moderate_message_storage_path(storage, user_id, chat_id):
+    # The storage calls moderate_message makes for a clean message from an unverified user
+    if not (await storage.get_chat_settings(chat_id))['auto_management']:
+        return
+    await storage.is_verified_user(user_id, chat_id)
+    await storage.increment_message_count(user_id, chat_id)
+    (await storage.get_auto_reply_matcher(chat_id)).match("hello everyone, how is it going?")
+
+async def run_messages(storage, messages):
+    start = time.perf_counter()
+    for i in range(messages):
+        await moderate_message_storage_path(storage, i % 50, -100)
+    return messages / (time.perf_counter() - start)
+
+async def bench_moderate_message(messages=2000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        shared = SQLiteStorage(Database(path))
+        await shared.add_auto_reply(-100, "hello", "Hi there!")
+
+        start = time.perf_counter()
+        for i in range(messages):
+            storage = SQLiteStorage(Database(path))
+            await moderate_message_storage_path(storage, i % 50, -100)
+            storage.db.close()
+        per_call = messages / (time.perf_counter() - start)
+
+        sqlite = await run_messages(shared, messages)
+        start = time.perf_counter()
+        await asyncio.gather(*(moderate_message_storage_path(shared, i % 50, -100) for i in range(messages)))
+        concurrent = messages / (time.perf_counter() - start)
+        await shared.close()
+
+    memory = MemoryStorage()
+    await memory.add_auto_reply(-100, "hello", "Hi there!")
+    in_memory = await run_messages(memory, messages * 10)
+    print(f"moderate_message: new Database per call {per_call:,.0f} msg/s, shared Database {sqlite:,.0f} msg/s, "
+          f"shared Database with concurrent handlers {concurrent:,.0f} msg/s, in-memory storage {in_memory:,.0f} msg/s")
+
+def list_rebuild_check_flood(timestamps, user_id, chat_id, now):
+    # The check_flood implementation FloodLimiter replaced
+    key = (user_id, chat_id)
+    timestamps[key].append(now)
+    timestamps[key] = [t for t in timestamps[key] if now - t < 30]
+    return len(timestamps[key]) > 5
+
+def bench_flood(users=1_000_000):
+    results = []
+    for name, limiter in (("list rebuild", defaultdict(list)), ("FloodLimiter", FloodLimiter())):
+        tracemalloc.start()
+        start = time.perf_counter()
+        for i in range(users):
+            now = i * 0.001
+            if name == "FloodLimiter":
+                limiter.hit(i, -100, now=now)
+            else:
+                list_rebuild_check_flood(limiter, i, -100, now)
+        elapsed = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results.append(f"{name} {users / elapsed:,.0f} msg/s, {len(limiter):,} keys, {memory / 2**20:,.0f} MiB")
+    print(f"flood check over {users:,} distinct users: " + "; ".join(results))
+
+def bench_auto_replies(triggers=2000, messages=2000):
+    replies = {f"trigger{i}": f"response {i}" for i in range(triggers)}
+    text = "just an ordinary group message that mentions nothing in particular " * 3
+    start = time.perf_counter()
+    for _ in range(messages):
+        for trigger, response in replies.items():
+            if trigger.lower() in text.lower():
+                break
+    naive = messages / (time.perf_counter() - start)
+    start = time.perf_counter()
+    matcher = AutoReplyMatcher(replies)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(messages):
+        matcher.match(text)
+    compiled = messages / (time.perf_counter() - start)
+    print(f"auto-replies with {triggers:,} triggers: loop {naive:,.0f} msg/s, "
+          f"AutoReplyMatcher {compiled:,.0f} msg/s (built in {build * 1000:.0f} ms)")
+
+def bench_toxicity_prefilter(messages=20000):
+    samples = ["hello everyone, how is it going?", "tu pagal hai kya", "you are such an idiot",
+               "kal meeting kitne baje hai?", "that movie was damn good", "तुम कहाँ हो?"]
+    prefilter = ToxicityPrefilter()
+    start = time.perf_counter()
+    for i in range(messages):
+        prefilter.classify(samples[i % len(samples)], -100)
+    rate = messages / (time.perf_counter() - start)
+    stats = prefilter.stats()
+    print(f"toxicity prefilter: {rate:,.0f} msg/s, {stats['escalation_rate']:.0%} of messages escalated to the LLM "
+          f"(previously 100%)")
+
+async def bench_toxicity_batching(messages=200, latency=0.05):
+    # Simulated DeepSeek with fixed latency behind a fixed limit of 5 concurrent requests
+    limiter = AdaptiveLimiter(initial=5, max_limit=5)
+    async def fake_deepseek(prompt, chat_id=None):
+        async with limiter.slot(chat_id):
+            await asyncio.sleep(latency)
+        count = prompt.count("\n")
+        return "\n".join(f"{i}: No" for i in range(1, count + 1)) if count else "No"
+    results = []
+    with mock.patch('ai.ask_deepseek', fake_deepseek):
+        for name, batcher in (("single calls", ai.ToxicityBatcher(max_batch=1)), ("batched", ai.ToxicityBatcher())):
+            latencies = []
+            async def check(i):
+                start = time.perf_counter()
+                await batcher.classify(f"message {i}")
+                latencies.append(time.perf_counter() - start)
+            await asyncio.gather(*(check(i) for i in range(messages)))
+            latencies.sort()
+            requests = batcher.stats()['requests'] or messages
+            results.append(f"{name} {requests} requests, p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:,.0f} ms")
+    print(f"toxicity burst of {messages} messages at {latency * 1000:.0f} ms per request: " + "; ".join(results))
+
+def bench_spam_index(fingerprints=1_000_000, lookups=10000, length=SPAM_MIN_TOKENS):
+    # Short words at the minimum message length are the worst case: they leave the most MinHash bins empty
+    rng = random.Random(1)
+    words = [''.join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 6))) for _ in range(50000)]
+    index = SpamIndex(max_clusters=fingerprints, window=10**9)
+    for i in range(fingerprints):
+        index.observe(" ".join(rng.choices(words, k=length)), i % 5000, now=i)
+    messages = [" ".join(rng.choices(words, k=length)) for _ in range(lookups)]
+    latencies = []
+    for message in messages:
+        start = time.perf_counter()
+        index.observe(message, 1, now=fingerprints)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"spam index with {len(index):,} {length}-word fingerprints: lookup p50 {latencies[len(latencies) // 2] * 1e6:,.0f} us, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:,.0f} us")
+
+async def bench_ai_scheduling(noisy=200, quiet_chats=10, capacity=12, latency=0.05):
+    # Simulated DeepSeek that answers `capacity` requests at a time and returns 429 beyond that
+    async def run(acquire):
+        in_flight = 0
+        async def request(chat_id, lane):
+            nonlocal in_flight
+            while True:
+                async with acquire(chat_id, lane) as slot:
+                    in_flight += 1
+                    status = 200 if in_flight <= capacity else 429
+                    await asyncio.sleep(latency if status == 200 else latency / 5)
+                    if slot:
+                        slot.record(status)
+                    in_flight -= 1
+                if status == 200:
+                    return
+        async def quiet(chat_id):
+            await asyncio.sleep(latency)
+            start = time.perf_counter()
+            await request(chat_id, INTERACTIVE)
+            return time.perf_counter() - start
+        start = time.perf_counter()
+        waits = await asyncio.gather(*(quiet(-i) for i in range(1, quiet_chats + 1)),
+                                     *(request(-100, None) for _ in range(noisy)))
+        return time.perf_counter() - start, max(waits[:quiet_chats])
+    semaphore = asyncio.Semaphore(5)
+    class Fixed:
+        def __init__(self, *args):
+            pass
+        async def __aenter__(self):
+            await semaphore.acquire()
+        async def __aexit__(self, *exc):
+            semaphore.release()
+    limiter = AdaptiveLimiter(max_limit=capacity * 2)
+    def adaptive(chat_id, lane):
+        return limiter.slot(chat_id, lane or BACKGROUND)
+    results = []
+    for name, acquire in (("fixed semaphore(5)", Fixed), ("adaptive", adaptive)):
+        total, quiet_wait = await run(acquire)
+        results.append(f"{name} {total * 1000:,.0f} ms total, quiet chats wait up to {quiet_wait * 1000:,.0f} ms")
+    print(f"AI scheduling, {noisy} requests from one chat and 1 /ask from each of {quiet_chats} others: "
+          + "; ".join(results) + f" (final limit {limiter.stats()['limit']})")
+
+if __name__ == '__main__':
+    asyncio.run(bench_moderate_message())
+    bench_flood()
+    bench_auto_replies()
+    bench_toxicity_prefilter()
+    asyncio.run(bench_toxicity_batching())
+    bench_spam_index()
+    asyncio.run(bench_ai_scheduling())
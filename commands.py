@@ -1,19 +1,25 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message
-from config import BOT_USERNAME, DEFAULT_WELCOME_IMAGE
-from database import Database, get_welcome_message, set_welcome_message, delete_welcome_message
-from database import get_goodbye_message, set_goodbye_message, delete_goodbye_message
-from database import toggle_welcome, toggle_goodbye, toggle_auto_management
-from database import add_auto_reply, remove_auto_reply, get_auto_replies
-from ui import create_keyboard, admin_only
-from ai import ask_deepseek, humanize_text, sanitize_input, is_hindi
+from config import BOT_USERNAME, DEFAULT_WELCOME_IMAGE, FLOOD_MAX_WINDOW, WELCOME_LANGUAGES, BOT_ADMINS
+from config import AUTO_REPLY_REGEX_MAX
+from matcher import REGEX_PREFIX, check_regex
+from ui import create_keyboard
+from admins import admin_only, admin_cache
+from backup import run_backup
+from moderation import toxicity_prefilter, moderation_pipeline, spam_index, global_bans
+from bans import parse_ban_list, format_ban_list
+from ai import stream_deepseek, humanize_text, sanitize_input, is_hindi, toxicity_batcher, ai_flights, ai_limiter
+import io
+import os
 import logging
 import re
+import asyncio
+from functools import partial
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
-def register_command_handlers(client: Client):
+def register_command_handlers(client: Client, storage):
     @client.on_message(filters.command("start"))
     async def start(_, message: Message):
         lang = "Hindi" if is_hindi(message.text or "") else "English"
@@ -65,9 +71,19 @@ def register_command_handlers(client: Client):
             return await message.reply("Please ask a question.<br>Example: <code>/ask What is a solar eclipse?</code>", parse_mode="HTML")
         question = sanitize_input(' '.join(message.command[1:]))
         processing_msg = await message.reply("🧠 Ustaad AI is thinking...", parse_mode="HTML")
-        response = await ask_deepseek(question)
-        await processing_msg.delete()
-        await message.reply(f"🧠 Ustaad AI Response:<br>{response}", parse_mode="HTML")
+        async def show(partial):
+            # A failed intermediate edit (rate limit, unbalanced HTML) is fine; the final one carries the answer
+            try:
+                await processing_msg.edit_text(f"🧠 Ustaad AI Response:<br>{partial} ▌", parse_mode="HTML")
+            except Exception as e:
+                logger.warning(f"Ask stream edit error: {e}")
+        async def ask(question):
+            return await stream_deepseek(question, show, message.chat.id)
+        if (await storage.get_chat_settings(message.chat.id))['ask_cache']:
+            response = await storage.ask_cached(question, ask)
+        else:
+            response = await ask(question)
+        await processing_msg.edit_text(f"🧠 Ustaad AI Response:<br>{response}", parse_mode="HTML")
 
     @client.on_message(filters.command("humanize"))
     async def humanize(_, message: Message):
@@ -89,6 +105,7 @@ def register_command_handlers(client: Client):
                 message.chat.id, user.id,
                 can_manage_chat=True, can_delete_messages=True, can_restrict_members=True, can_pin_messages=True
             )
+            admin_cache.invalidate(message.chat.id)
             await message.reply(f"✅ {user.mention} has been promoted to admin.", parse_mode="HTML")
         except Exception as e:
             logger.error(f"Promote error: {e}")
@@ -101,6 +118,7 @@ def register_command_handlers(client: Client):
         try:
             user = message.reply_to_message.from_user if message.reply_to_message else await client.get_users(message.command[1])
             await client.promote_chat_member(message.chat.id, user.id)
+            admin_cache.invalidate(message.chat.id)
             await message.reply(f"✅ {user.mention} has been demoted.", parse_mode="HTML")
         except Exception as e:
             logger.error(f"Demote error: {e}")
@@ -131,8 +149,7 @@ def register_command_handlers(client: Client):
         try:
             user = await client.get_users(message.command[1])
             await client.unban_chat_member(message.chat.id, user.id)
-            db = Database('group_manager.db')
-            set_ban_status(db, user.id, message.chat.id, False)
+            await storage.set_ban_status(user.id, message.chat.id, False)
             await message.reply(f"✅ {user.mention} has been unbanned.", parse_mode="HTML")
         except Exception as e:
             logger.error(f"Unban error: {e}")
@@ -318,8 +335,15 @@ def register_command_handlers(client: Client):
     @client.on_message(filters.command("clean") & filters.group & admin_only())
     async def clean_messages(_, message: Message):
         try:
-            async for msg in client.iter_history(message.chat.id, limit=100):
-                if msg.from_user.id == client.me.id or await is_toxic_message(msg.text or ""):
+            history = [msg async for msg in client.iter_history(message.chat.id, limit=100)]
+            # Checked concurrently so the batcher can fold them into a few AI requests
+            verdicts = await asyncio.gather(*(
+                storage.classify_toxicity(msg.text, partial(toxicity_batcher.classify, chat_id=message.chat.id))
+                for msg in history if msg.text and msg.from_user.id != client.me.id
+            ))
+            verdicts = iter(verdicts)
+            for msg in history:
+                if msg.from_user.id == client.me.id or (msg.text and next(verdicts)):
                     await msg.delete()
             await message.reply("✅ Cleaned bot messages and spam.", parse_mode="HTML")
         except Exception as e:
@@ -331,14 +355,12 @@ def register_command_handlers(client: Client):
         if len(message.command) < 2:
             return await message.reply("Please provide a welcome message: <code>/setwelcome Welcome {name}!</code>", parse_mode="HTML")
         msg = ' '.join(message.command[1:])
-        db = Database('group_manager.db')
-        set_welcome_message(db, message.chat.id, msg)
+        await storage.set_welcome_message(message.chat.id, msg)
         await message.reply("✅ Welcome message set.", parse_mode="HTML")
 
     @client.on_message(filters.command("delwelcome") & filters.group & admin_only())
     async def delete_welcome(_, message: Message):
-        db = Database('group_manager.db')
-        delete_welcome_message(db, message.chat.id)
+        await storage.delete_welcome_message(message.chat.id)
         await message.reply("✅ Welcome message deleted.", parse_mode="HTML")
 
     @client.on_message(filters.command("setgoodbye") & filters.group & admin_only())
@@ -346,14 +368,12 @@ def register_command_handlers(client: Client):
         if len(message.command) < 2:
             return await message.reply("Please provide a goodbye message: <code>/setgoodbye Goodbye {name}!</code>", parse_mode="HTML")
         msg = ' '.join(message.command[1:])
-        db = Database('group_manager.db')
-        set_goodbye_message(db, message.chat.id, msg)
+        await storage.set_goodbye_message(message.chat.id, msg)
         await message.reply("✅ Goodbye message set.", parse_mode="HTML")
 
     @client.on_message(filters.command("delgoodbye") & filters.group & admin_only())
     async def delete_goodbye(_, message: Message):
-        db = Database('group_manager.db')
-        delete_goodbye_message(db, message.chat.id)
+        await storage.delete_goodbye_message(message.chat.id)
         await message.reply("✅ Goodbye message deleted.", parse_mode="HTML")
 
     @client.on_message(filters.command("welcome") & filters.group & admin_only())
@@ -361,8 +381,7 @@ def register_command_handlers(client: Client):
         if len(message.command) < 2 or message.command[1].lower() not in ["on", "off"]:
             return await message.reply("Please specify: <code>/welcome on</code> or <code>/welcome off</code>", parse_mode="HTML")
         status = message.command[1].lower() == "on"
-        db = Database('group_manager.db')
-        toggle_welcome(db, message.chat.id, status)
+        await storage.toggle_welcome(message.chat.id, status)
         await message.reply(f"✅ Welcome messages {'enabled' if status else 'disabled'}.", parse_mode="HTML")
 
     @client.on_message(filters.command("goodbye") & filters.group & admin_only())
@@ -370,8 +389,7 @@ def register_command_handlers(client: Client):
         if len(message.command) < 2 or message.command[1].lower() not in ["on", "off"]:
             return await message.reply("Please specify: <code>/goodbye on</code> or <code>/goodbye off</code>", parse_mode="HTML")
         status = message.command[1].lower() == "on"
-        db = Database('group_manager.db')
-        toggle_goodbye(db, message.chat.id, status)
+        await storage.toggle_goodbye(message.chat.id, status)
         await message.reply(f"✅ Goodbye messages {'enabled' if status else 'disabled'}.", parse_mode="HTML")
 
     @client.on_message(filters.command("setwelcomeimage") & filters.group & admin_only())
@@ -379,18 +397,37 @@ def register_command_handlers(client: Client):
         if len(message.command) < 2 or not re.match(r'https?://\S+', message.command[1]):
             return await message.reply("Please provide a valid image URL: <code>/setwelcomeimage https://example.com/image.jpg</code>", parse_mode="HTML")
         image_url = message.command[1]
-        db = Database('group_manager.db')
-        msg, _ = get_welcome_message(db, message.chat.id)
-        set_welcome_message(db, message.chat.id, msg or "Welcome {name}!", image_url)
+        msg, _ = await storage.get_welcome_message(message.chat.id)
+        await storage.set_welcome_message(message.chat.id, msg or "Welcome {name}!", image_url)
         await message.reply("✅ Welcome image set.", parse_mode="HTML")
 
+    @client.on_message(filters.command("setlang") & filters.group & admin_only())
+    async def set_language(_, message: Message):
+        if len(message.command) < 2 or message.command[1].lower() not in WELCOME_LANGUAGES:
+            return await message.reply(f"Usage: <code>/setlang {'/'.join(WELCOME_LANGUAGES)}</code>", parse_mode="HTML")
+        language = message.command[1].lower()
+        await storage.set_language(message.chat.id, language)
+        await message.reply(f"✅ Welcomes will be in {WELCOME_LANGUAGES[language]}.", parse_mode="HTML")
+
     @client.on_message(filters.command("filter") & filters.group & admin_only())
     async def add_filter(_, message: Message):
         if len(message.command) < 3:
-            return await message.reply("Usage: <code>/filter word response</code>", parse_mode="HTML")
+            return await message.reply(
+                "Usage: <code>/filter word response</code><br>"
+                "Use <code>word:hi</code> to match whole words only or <code>re:pattern</code> for a regex.",
+                parse_mode="HTML"
+            )
         trigger, response = message.command[1], ' '.join(message.command[2:])
-        db = Database('group_manager.db')
-        add_auto_reply(db, message.chat.id, trigger, response)
+        if trigger.startswith(REGEX_PREFIX):
+            existing = await storage.get_auto_replies(message.chat.id)
+            regexes = [other for other in existing if other.startswith(REGEX_PREFIX) and other != trigger]
+            if len(regexes) >= AUTO_REPLY_REGEX_MAX:
+                return await message.reply(f"❌ This group already has {AUTO_REPLY_REGEX_MAX} regex auto-replies.", parse_mode="HTML")
+            try:
+                check_regex(trigger[len(REGEX_PREFIX):])
+            except re.error as e:
+                return await message.reply(f"❌ Invalid regex: {e}", parse_mode="HTML")
+        await storage.add_auto_reply(message.chat.id, trigger, response)
         await message.reply(f"✅ Auto-reply set for '{trigger}'", parse_mode="HTML")
 
     @client.on_message(filters.command("stop") & filters.group & admin_only())
@@ -398,14 +435,12 @@ def register_command_handlers(client: Client):
         if len(message.command) < 2:
             return await message.reply("Usage: <code>/stop word</code>", parse_mode="HTML")
         trigger = message.command[1]
-        db = Database('group_manager.db')
-        remove_auto_reply(db, message.chat.id, trigger)
+        await storage.remove_auto_reply(message.chat.id, trigger)
         await message.reply(f"✅ Auto-reply for '{trigger}' removed.", parse_mode="HTML")
 
     @client.on_message(filters.command("filters") & filters.group & admin_only())
     async def list_filters(_, message: Message):
-        db = Database('group_manager.db')
-        auto_replies = get_auto_replies(db, message.chat.id)
+        auto_replies = await storage.get_auto_replies(message.chat.id)
         if not auto_replies:
             return await message.reply("No auto-replies set.", parse_mode="HTML")
         response = "Active auto-replies:<br>" + "<br>".join(f"• {trigger}: {response}" for trigger, response in auto_replies.items())
@@ -416,10 +451,141 @@ def register_command_handlers(client: Client):
         if len(message.command) < 2 or message.command[1].lower() not in ["on", "off"]:
             return await message.reply("Please specify: <code>/toggleauto on</code> or <code>/toggleauto off</code>", parse_mode="HTML")
         status = message.command[1].lower() == "on"
-        db = Database('group_manager.db')
-        toggle_auto_management(db, message.chat.id, status)
+        await storage.toggle_auto_management(message.chat.id, status)
         await message.reply(f"✅ Auto-management {'enabled' if status else 'disabled'}.", parse_mode="HTML")
 
+    @client.on_message(filters.command("setflood") & filters.group & admin_only())
+    async def set_flood(_, message: Message):
+        if len(message.command) < 3 or not message.command[1].isdigit() or not message.command[2].isdigit():
+            return await message.reply("Usage: <code>/setflood messages seconds</code> (e.g. <code>/setflood 5 30</code>)", parse_mode="HTML")
+        limit, window = int(message.command[1]), int(message.command[2])
+        if not 1 <= limit <= 100 or not 1 <= window <= FLOOD_MAX_WINDOW:
+            return await message.reply(f"❌ Use 1-100 messages and 1-{FLOOD_MAX_WINDOW} seconds.", parse_mode="HTML")
+        await storage.set_flood_limit(message.chat.id, limit, window)
+        await message.reply(f"✅ Flood limit set to {limit} messages per {window} seconds.", parse_mode="HTML")
+
+    @client.on_message(filters.command("toxicity") & filters.group & admin_only())
+    async def toxicity(_, message: Message):
+        if len(message.command) == 1:
+            settings = await storage.get_chat_settings(message.chat.id)
+            stats = toxicity_prefilter.stats(message.chat.id)
+            cache = storage.toxicity_verdicts.stats()
+            batches = toxicity_batcher.stats()
+            queue = moderation_pipeline.stats()
+            return await message.reply(
+                f"🛡 <b>Toxicity prefilter</b><br>"
+                f"Thresholds: clean below {settings['toxicity_clean']:.2f}, toxic at {settings['toxicity_toxic']:.2f}<br>"
+                f"Checked: {stats['checked']} (clean {stats['clean']}, toxic {stats['toxic']})<br>"
+                f"Escalated to AI: {stats['escalated']} ({stats['escalation_rate']:.1%})<br>"
+                f"Verdict cache: {cache['entries']} entries, {cache['hit_ratio']:.1%} hit ratio "
+                f"({cache['hits']} memory, {cache['persisted_hits']} persisted, {cache['misses']} misses)<br>"
+                f"AI requests: {batches['requests']} for {batches['messages']} messages "
+                f"(avg batch {batches['batch_size']:.1f}, {batches['fallbacks']} fallbacks)<br>"
+                f"Queue: depth {queue['depth']} (max {queue['max_depth']}), wait avg {queue['wait_avg'] * 1000:.0f} ms, "
+                f"p95 {queue['wait_p95'] * 1000:.0f} ms; shed {queue['shed'].get('local', 0)} to local checks, "
+                f"{queue['shed'].get('trusted', 0)} trusted members skipped<br>"
+                f"Cross-chat spam: {spam_index.removed} removed of {spam_index.flagged} matched, {len(spam_index)} message clusters tracked",
+                parse_mode="HTML"
+            )
+        try:
+            clean, toxic = float(message.command[1]), float(message.command[2])
+        except (IndexError, ValueError):
+            return await message.reply("Usage: <code>/toxicity clean toxic</code> (e.g. <code>/toxicity 0.2 0.8</code>)", parse_mode="HTML")
+        if not 0 <= clean <= toxic <= 1:
+            return await message.reply("❌ Use thresholds between 0 and 1, with clean no higher than toxic.", parse_mode="HTML")
+        await storage.set_toxicity_thresholds(message.chat.id, clean, toxic)
+        await message.reply(f"✅ Messages scoring below {clean:.2f} skip the AI check; {toxic:.2f} or above are removed directly.", parse_mode="HTML")
+
+    @client.on_message(filters.command("askcache") & filters.group & admin_only())
+    async def toggle_ask_cache(_, message: Message):
+        if len(message.command) < 2 or message.command[1].lower() not in ["on", "off"]:
+            return await message.reply("Please specify: <code>/askcache on</code> or <code>/askcache off</code>", parse_mode="HTML")
+        status = message.command[1].lower() == "on"
+        await storage.toggle_ask_cache(message.chat.id, status)
+        await message.reply(f"✅ Cached /ask answers {'enabled' if status else 'disabled'} in this group.", parse_mode="HTML")
+
+    @client.on_message(filters.command("askstats") & filters.user(BOT_ADMINS))
+    async def ask_stats(_, message: Message):
+        if len(message.command) > 1 and message.command[1].lower() == "purge":
+            purged = await storage.purge_ask_responses()
+            return await message.reply(f"✅ Purged {purged} cached /ask answers.", parse_mode="HTML")
+        cache = storage.ask_responses.stats()
+        flights = ai_flights.stats()
+        limiter = ai_limiter.stats()
+        await message.reply(
+            f"🧠 <b>/ask cache</b><br>"
+            f"Entries in memory: {cache['entries']}<br>"
+            f"Hit ratio: {cache['hit_ratio']:.1%} ({cache['hits']} memory, {cache['persisted_hits']} persisted, "
+            f"{cache['misses']} misses)<br>"
+            f"Identical AI requests coalesced: {flights['coalesced']} of {flights['calls']} "
+            f"({flights['coalesced_ratio']:.1%}), {flights['in_flight']} in flight<br>"
+            f"AI concurrency: limit {limiter['limit']}, {limiter['active']} active, {limiter['waiting']} waiting; "
+            f"raised {limiter['increases']} and lowered {limiter['decreases']} times<br>"
+            f"Served: {limiter['interactive']} /ask, {limiter['background']} background<br>"
+            f"Use <code>/askstats purge</code> to drop every cached answer.",
+            parse_mode="HTML"
+        )
+
+    @client.on_message(filters.command("globalbans") & filters.group & admin_only())
+    async def toggle_global_bans(_, message: Message):
+        if len(message.command) < 2 or message.command[1].lower() not in ["on", "off"]:
+            return await message.reply("Please specify: <code>/globalbans on</code> or <code>/globalbans off</code>", parse_mode="HTML")
+        status = message.command[1].lower() == "on"
+        await storage.toggle_global_bans(message.chat.id, status)
+        await message.reply(f"✅ Shared ban list {'enforced' if status else 'ignored'} in this group.", parse_mode="HTML")
+
+    @client.on_message(filters.command("gban") & filters.user(BOT_ADMINS))
+    async def global_ban(_, message: Message):
+        if not message.reply_to_message and len(message.command) < 2:
+            return await message.reply("Please reply to a user or mention them: <code>/gban @username [reason]</code>", parse_mode="HTML")
+        try:
+            if message.reply_to_message:
+                user, reason = message.reply_to_message.from_user, " ".join(message.command[1:])
+            else:
+                user, reason = await client.get_users(message.command[1]), " ".join(message.command[2:])
+            await global_bans.add(storage, [(user.id, reason or "No reason", message.from_user.id)])
+            await message.reply(f"🌐 {user.mention} added to the shared ban list.", parse_mode="HTML")
+        except Exception as e:
+            logger.error(f"Global ban error: {e}")
+            await message.reply("❌ Failed to add user to the shared ban list.", parse_mode="HTML")
+
+    @client.on_message(filters.command("ungban") & filters.user(BOT_ADMINS))
+    async def global_unban(_, message: Message):
+        if not message.reply_to_message and len(message.command) < 2:
+            return await message.reply("Please reply to a user or mention them: <code>/ungban @username</code>", parse_mode="HTML")
+        try:
+            user = message.reply_to_message.from_user if message.reply_to_message else await client.get_users(message.command[1])
+            if await global_bans.remove(storage, user.id):
+                await message.reply(f"✅ {user.mention} removed from the shared ban list.", parse_mode="HTML")
+            else:
+                await message.reply(f"{user.mention} is not on the shared ban list.", parse_mode="HTML")
+        except Exception as e:
+            logger.error(f"Global unban error: {e}")
+            await message.reply("❌ Failed to update the shared ban list.", parse_mode="HTML")
+
+    @client.on_message(filters.command("exportbans") & filters.user(BOT_ADMINS))
+    async def export_bans(_, message: Message):
+        bans = await storage.get_global_bans()
+        document = io.BytesIO(format_ban_list(bans).encode())
+        document.name = "global_bans.csv"
+        await message.reply_document(document, caption=f"🌐 {len(bans)} shared bans")
+
+    @client.on_message(filters.command("importbans") & filters.user(BOT_ADMINS))
+    async def import_bans(_, message: Message):
+        if not message.reply_to_message or not message.reply_to_message.document:
+            return await message.reply("Reply to a CSV file of <code>user_id,reason</code> lines with <code>/importbans</code>", parse_mode="HTML")
+        path = await message.reply_to_message.download()
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                entries = parse_ban_list(f.read(), message.from_user.id)
+            added = await global_bans.add(storage, entries)
+            await message.reply(f"✅ Imported {added} shared bans.", parse_mode="HTML")
+        except Exception as e:
+            logger.error(f"Ban import error: {e}")
+            await message.reply("❌ Failed to import the ban list.", parse_mode="HTML")
+        finally:
+            os.remove(path)
+
     @client.on_message(filters.command("id"))
     async def get_id(_, message: Message):
         if message.reply_to_message:
@@ -434,9 +600,8 @@ def register_command_handlers(client: Client):
             return await message.reply("Please reply to a user or mention them: <code>/userinfo @username</code>", parse_mode="HTML")
         try:
             user = message.reply_to_message.from_user if message.reply_to_message else await client.get_users(message.command[1])
-            db = Database('group_manager.db')
-            msg_count, warn_count, banned = get_user_stats(db, user.id, message.chat.id)
-            verified = is_verified_user(db, user.id, message.chat.id)
+            msg_count, warn_count, banned = await storage.get_user_stats(user.id, message.chat.id)
+            verified = await storage.is_verified_user(user.id, message.chat.id)
             await message.reply(
                 f"<b>👤 User Info</b><br><br>"
                 f"Name: {user.mention}<br>"
@@ -471,8 +636,8 @@ def register_command_handlers(client: Client):
     async def list_admins(_, message: Message):
         try:
             admins = []
-            async for member in client.iter_chat_members(message.chat.id, filter="administrators"):
-                admins.append(f"• {member.user.mention}")
+            for user in (await admin_cache.get(client, message.chat.id)).values():
+                admins.append(f"• {user.mention}")
             await message.reply(
                 "<b>👑 Admins</b><br><br>" + "<br>".join(admins) if admins else "No admins found.",
                 parse_mode="HTML"
@@ -487,8 +652,7 @@ def register_command_handlers(client: Client):
             return await message.reply("Please reply to a user or mention them: <code>/stats @username</code>", parse_mode="HTML")
         try:
             user = message.reply_to_message.from_user if message.reply_to_message else await client.get_users(message.command[1])
-            db = Database('group_manager.db')
-            msg_count, warn_count, banned = get_user_stats(db, user.id, message.chat.id)
+            msg_count, warn_count, banned = await storage.get_user_stats(user.id, message.chat.id)
             await message.reply(
                 f"<b>📊 Stats for {user.mention}</b><br><br>"
                 f"Messages: {msg_count}<br>"
@@ -499,3 +663,35 @@ def register_command_handlers(client: Client):
         except Exception as e:
             logger.error(f"Stats error: {e}")
             await message.reply("❌ Failed to fetch stats.", parse_mode="HTML")
+
+    @client.on_message(filters.command("dbstats") & filters.user(BOT_ADMINS))
+    async def db_stats(_, message: Message):
+        if not storage.query_stats:
+            return await message.reply("Query instrumentation is disabled. Set <code>DB_INSTRUMENTATION=true</code> to enable it.", parse_mode="HTML")
+        stats = storage.query_stats.snapshot()[:10]
+        if not stats:
+            return await message.reply("No queries recorded yet.", parse_mode="HTML")
+        lines = [
+            f"• <code>{stat['query'][:80]}</code><br>"
+            f"  calls {stat['calls']}, total {stat['total_ms']:.1f} ms, "
+            f"p50/p95/p99 {stat['p50_ms']:.2f}/{stat['p95_ms']:.2f}/{stat['p99_ms']:.2f} ms, rows {stat['rows']}"
+            for stat in stats
+        ]
+        await message.reply("<b>🗄 Top queries by total time</b><br><br>" + "<br>".join(lines), parse_mode="HTML")
+
+    @client.on_message(filters.command("backup") & filters.user(BOT_ADMINS))
+    async def backup_database(_, message: Message):
+        processing_msg = await message.reply("💾 Backing up the database...", parse_mode="HTML")
+        try:
+            report = await run_backup(storage)
+            await processing_msg.edit_text(
+                f"✅ Backup complete.<br><br>"
+                f"Size: {report['size'] / 1024:.1f} KB (uncompressed {report['raw_size'] / 1024:.1f} KB)<br>"
+                f"Duration: {report['duration']:.2f}s",
+                parse_mode="HTML"
+            )
+        except NotImplementedError as e:
+            await processing_msg.edit_text(f"❌ {e}.", parse_mode="HTML")
+        except Exception as e:
+            logger.error(f"Backup error: {e}")
+            await processing_msg.edit_text("❌ Backup failed.", parse_mode="HTML")
@@ -18,6 +18,120 @@ except (TypeError, ValueError) as e:
     logger.error(f"Environment variable error: {e}")
     raise SystemExit("Missing or invalid environment variables. Check .env file.")
 
+# DeepSeek client: one pooled keep-alive session (timeouts in seconds)
+DEEPSEEK_URL = os.getenv("DEEPSEEK_URL", "https://api.deepseek.com/v1/chat/completions")
+DEEPSEEK_CONNECTIONS = int(os.getenv("DEEPSEEK_CONNECTIONS", 20))
+DEEPSEEK_KEEPALIVE = float(os.getenv("DEEPSEEK_KEEPALIVE", 60))
+DEEPSEEK_DNS_TTL = int(os.getenv("DEEPSEEK_DNS_TTL", 300))
+DEEPSEEK_CONNECT_TIMEOUT = float(os.getenv("DEEPSEEK_CONNECT_TIMEOUT", 10))
+DEEPSEEK_READ_TIMEOUT = float(os.getenv("DEEPSEEK_READ_TIMEOUT", 60))
+
+# Database
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+DATABASE_PATH = os.getenv("DATABASE_PATH", "group_manager.db")
+STATS_FLUSH_INTERVAL = int(os.getenv("STATS_FLUSH_INTERVAL", 5))
+STATS_FLUSH_SIZE = int(os.getenv("STATS_FLUSH_SIZE", 500))
+SETTINGS_CACHE_SIZE = int(os.getenv("SETTINGS_CACHE_SIZE", 10000))
+AUTO_REPLY_CACHE_SIZE = int(os.getenv("AUTO_REPLY_CACHE_SIZE", 2000))
+DB_INSTRUMENTATION = os.getenv("DB_INSTRUMENTATION", "false").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 50))
+
+# re: auto-reply triggers run on the event loop, so their size, count and the text they scan are bounded
+AUTO_REPLY_REGEX_MAX_LENGTH = int(os.getenv("AUTO_REPLY_REGEX_MAX_LENGTH", 100))
+AUTO_REPLY_REGEX_MAX = int(os.getenv("AUTO_REPLY_REGEX_MAX", 10))
+AUTO_REPLY_REGEX_MAX_TEXT = int(os.getenv("AUTO_REPLY_REGEX_MAX_TEXT", 500))
+
+# Flood control (per-chat overrides via /setflood)
+FLOOD_LIMIT = int(os.getenv("FLOOD_LIMIT", 5))
+FLOOD_WINDOW = int(os.getenv("FLOOD_WINDOW", 30))
+FLOOD_MAX_WINDOW = int(os.getenv("FLOOD_MAX_WINDOW", 300))
+FLOOD_MAX_KEYS = int(os.getenv("FLOOD_MAX_KEYS", 200000))
+
+# /ask answers are cached by normalized question for ASK_CACHE_TTL seconds (per-chat opt-out via /askcache)
+ASK_CACHE_SIZE = int(os.getenv("ASK_CACHE_SIZE", 5000))
+ASK_CACHE_TTL = int(os.getenv("ASK_CACHE_TTL", 604800))
+# Streamed /ask answers edit the reply at most once per ASK_STREAM_EDIT_INTERVAL seconds (Telegram edit limits)
+ASK_STREAM_EDIT_INTERVAL = float(os.getenv("ASK_STREAM_EDIT_INTERVAL", 1))
+
+# AI concurrency adapts between AI_CONCURRENCY_MIN and AI_CONCURRENCY_MAX: it grows while DeepSeek starts answering
+# within AI_LATENCY_TARGET seconds and halves on 429s, 5xx errors, failures or slower answers. /ask is served ahead
+# of background moderation (AI_INTERACTIVE_WEIGHT requests to one) and waiting chats take turns
+AI_CONCURRENCY_INITIAL = int(os.getenv("AI_CONCURRENCY_INITIAL", 5))
+AI_CONCURRENCY_MIN = int(os.getenv("AI_CONCURRENCY_MIN", 1))
+AI_CONCURRENCY_MAX = int(os.getenv("AI_CONCURRENCY_MAX", 20))
+AI_LATENCY_TARGET = float(os.getenv("AI_LATENCY_TARGET", 10))
+AI_INTERACTIVE_WEIGHT = int(os.getenv("AI_INTERACTIVE_WEIGHT", 3))
+
+# Toxicity prefilter: scores below CLEAN_BELOW skip the LLM, scores at TOXIC_AT or above with two strong signals
+# are removed without asking it (per-chat overrides via /toxicity)
+TOXICITY_CLEAN_BELOW = float(os.getenv("TOXICITY_CLEAN_BELOW", 0.2))
+TOXICITY_TOXIC_AT = float(os.getenv("TOXICITY_TOXIC_AT", 0.8))
+TOXICITY_CACHE_SIZE = int(os.getenv("TOXICITY_CACHE_SIZE", 50000))
+TOXICITY_CACHE_TTL = int(os.getenv("TOXICITY_CACHE_TTL", 86400))
+TOXICITY_CACHE_PERSIST = os.getenv("TOXICITY_CACHE_PERSIST", "false").lower() == "true"
+# Concurrent AI toxicity checks are batched into one request (batch size 1 disables batching)
+TOXICITY_BATCH_SIZE = int(os.getenv("TOXICITY_BATCH_SIZE", 20))
+TOXICITY_BATCH_WAIT_MS = float(os.getenv("TOXICITY_BATCH_WAIT_MS", 20))
+
+# Moderation queue: AI checks beyond MODERATION_SHED_DEPTH queued jobs are skipped (never punished), and members with
+# at least MODERATION_TRUSTED_MESSAGES messages skip them; PRIORITY_CHATS (comma-separated IDs) are served first.
+# Each worker waits on its check's batch, so there are enough to fill a batch for every concurrent AI request.
+MODERATION_WORKERS = int(os.getenv("MODERATION_WORKERS", TOXICITY_BATCH_SIZE * AI_CONCURRENCY_MAX))
+MODERATION_QUEUE_SIZE = int(os.getenv("MODERATION_QUEUE_SIZE", 1000))
+MODERATION_SHED_DEPTH = int(os.getenv("MODERATION_SHED_DEPTH", 200))
+MODERATION_TRUSTED_MESSAGES = int(os.getenv("MODERATION_TRUSTED_MESSAGES", 100))
+PRIORITY_CHATS = {int(chat_id) for chat_id in os.getenv("PRIORITY_CHATS", "").split(",") if chat_id.strip()}
+
+# Welcomes: joins within WELCOME_BATCH_WINDOW seconds share one welcome, sent at most every WELCOME_MIN_INTERVAL
+# seconds per chat; RAID_JOIN_THRESHOLD joins within RAID_WINDOW seconds pause welcomes for RAID_DURATION (0 disables)
+WELCOME_BATCH_WINDOW = float(os.getenv("WELCOME_BATCH_WINDOW", 5))
+WELCOME_MIN_INTERVAL = float(os.getenv("WELCOME_MIN_INTERVAL", 60))
+WELCOME_MAX_MENTIONS = int(os.getenv("WELCOME_MAX_MENTIONS", 20))
+RAID_JOIN_THRESHOLD = int(os.getenv("RAID_JOIN_THRESHOLD", 30))
+RAID_WINDOW = int(os.getenv("RAID_WINDOW", 60))
+RAID_DURATION = int(os.getenv("RAID_DURATION", 600))
+
+# Cross-chat spam: a message whose near-duplicates (estimated Jaccard similarity of SPAM_SIMILARITY) were sent in
+# SPAM_CHAT_THRESHOLD chats within SPAM_WINDOW seconds is removed without an AI check (threshold 0 disables)
+SPAM_CHAT_THRESHOLD = int(os.getenv("SPAM_CHAT_THRESHOLD", 5))
+SPAM_WINDOW = int(os.getenv("SPAM_WINDOW", 600))
+SPAM_SIMILARITY = float(os.getenv("SPAM_SIMILARITY", 0.6))
+SPAM_MIN_TOKENS = int(os.getenv("SPAM_MIN_TOKENS", 6))
+SPAM_INDEX_MAX = int(os.getenv("SPAM_INDEX_MAX", 1000000))
+
+# Admin lists are cached per chat and refreshed on admin changes
+ADMIN_CACHE_TTL = int(os.getenv("ADMIN_CACHE_TTL", 600))
+
+# Welcome templates are pre-generated per language and topped up from WELCOME_POOL_LOW to WELCOME_POOL_TARGET,
+# one AI request at most every WELCOME_POOL_INTERVAL seconds
+WELCOME_LANGUAGE = os.getenv("WELCOME_LANGUAGE", "hi")
+WELCOME_LANGUAGES = {"hi": "Hindi", "en": "English"}
+WELCOME_POOL_LOW = int(os.getenv("WELCOME_POOL_LOW", 10))
+WELCOME_POOL_TARGET = int(os.getenv("WELCOME_POOL_TARGET", 30))
+WELCOME_POOL_INTERVAL = float(os.getenv("WELCOME_POOL_INTERVAL", 10))
+WELCOME_POOL_CHECK = int(os.getenv("WELCOME_POOL_CHECK", 600))
+
+# Shared ban list: chats opt in with /globalbans; BOT_ADMINS (comma-separated user IDs) manage the list
+BOT_ADMINS = [int(user_id) for user_id in os.getenv("BOT_ADMINS", "").split(",") if user_id.strip()]
+GLOBAL_BANS_DEFAULT = os.getenv("GLOBAL_BANS_DEFAULT", "false").lower() == "true"
+GLOBAL_BAN_CAPACITY = int(os.getenv("GLOBAL_BAN_CAPACITY", 1000000))
+GLOBAL_BAN_FP_RATE = float(os.getenv("GLOBAL_BAN_FP_RATE", 0.001))
+
+# Maintenance (retention of 0 disables a policy)
+MAINTENANCE_INTERVAL = int(os.getenv("MAINTENANCE_INTERVAL", 3600))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", 500))
+WARNING_RETENTION_DAYS = int(os.getenv("WARNING_RETENTION_DAYS", 30))
+DEPARTED_CHAT_RETENTION_DAYS = int(os.getenv("DEPARTED_CHAT_RETENTION_DAYS", 7))
+POLL_RETENTION_HOURS = int(os.getenv("POLL_RETENTION_HOURS", 72))
+VACUUM_PAGES = int(os.getenv("VACUUM_PAGES", 1000))
+
+# Backups (interval of 0 disables scheduled backups)
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", 86400))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", 7))
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", 256))
+BACKUP_SLEEP = float(os.getenv("BACKUP_SLEEP", 0.05))
+
 # Image URLs
 DEFAULT_WELCOME_IMAGE = "https://graph.org/file/a00fd3a852b79eb8f17e8-68ab656cb3a31269fe.jpg"
 MAIN_MENU_IMG = DEFAULT_WELCOME_IMAGE
@@ -72,7 +186,8 @@ COMMAND_DETAILS = {
             "/delgoodbye - Delete goodbye message",
             "/welcome on/off - Toggle welcome messages",
             "/goodbye on/off - Toggle goodbye messages",
-            "/setwelcomeimage [url] - Set welcome image"
+            "/setwelcomeimage [url] - Set welcome image",
+            "/setlang hi/en - Set the language of generated welcomes"
         ]
     },
     "automation": {
@@ -80,10 +195,14 @@ COMMAND_DETAILS = {
         "description": "Automate group tasks and replies",
         "image": DEFAULT_WELCOME_IMAGE,
         "commands": [
-            "/filter word response - Add auto-reply for a word",
+            "/filter word response - Add auto-reply for a word (prefix word: for whole words, re: for regex)",
             "/stop word - Remove auto-reply",
             "/filters - List active auto-replies",
-            "/toggleauto on/off - Toggle automatic management"
+            "/toggleauto on/off - Toggle automatic management",
+            "/setflood messages seconds - Set flood limit (e.g., 5 30)",
+            "/globalbans on/off - Enforce the shared ban list in this group",
+            "/askcache on/off - Toggle cached answers for /ask",
+            "/toxicity [clean toxic] - Show prefilter stats or set its thresholds (e.g., 0.2 0.8)"
         ]
     },
     "info_commands": {
@@ -95,7 +214,9 @@ COMMAND_DETAILS = {
             "/userinfo @user - Show user details",
             "/chatinfo - Show group details",
             "/admins - List group admins",
-            "/stats @user - Show user activity and warnings"
+            "/stats @user - Show user activity and warnings",
+            "/dbstats - Show database query statistics (bot admins only)",
+            "/backup - Back up the database now (bot admins only)"
         ]
     },
     "ai_features": {
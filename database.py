@@ -1,29 +1,68 @@
 import sqlite3
 import logging
-from threading import Lock
+import asyncio
+import re
+import time
+from threading import Lock, local
+from concurrent.futures import ThreadPoolExecutor
 import atexit
+from functools import lru_cache
 from datetime import datetime
 import json
-from config import DEFAULT_WELCOME_IMAGE
+from collections import defaultdict, OrderedDict, deque
+from config import DEFAULT_WELCOME_IMAGE, STATS_FLUSH_INTERVAL, STATS_FLUSH_SIZE, SETTINGS_CACHE_SIZE
+from matcher import normalize_trigger
+from config import DB_INSTRUMENTATION, SLOW_QUERY_MS, FLOOD_LIMIT, FLOOD_WINDOW, TOXICITY_CLEAN_BELOW, TOXICITY_TOXIC_AT, WELCOME_LANGUAGE
+from config import GLOBAL_BANS_DEFAULT
 
 logger = logging.getLogger(__name__)
 
 class Database:
-    def __init__(self, db_name):
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
+    def __init__(self, db_name, readers=2):
+        self.db_name = db_name
+        self.query_stats = QueryStats() if DB_INSTRUMENTATION else None
+        self.conn = self._connect(auto_vacuum=True)
         self.lock = Lock()
         self.init_tables()
+        # One thread owns all writes; reads go to a small pool with their own connections
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self.in_memory = db_name == ":memory:"
+        self.reader = self.writer if self.in_memory else ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self.local = local()
+        self.reader_conns = []
+        self.stats_buffer = StatsBuffer(self)
+        self.settings_cache = LRUCache()
         atexit.register(self.close)
 
+    def _connect(self, auto_vacuum=False):
+        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        if auto_vacuum:
+            # Only takes effect on a fresh database; init_tables converts existing files once
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader_conn(self):
+        if self.in_memory:
+            return self.conn
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self.local.conn = conn
+            with self.lock:
+                self.reader_conns.append(conn)
+        return conn
+
     def init_tables(self):
         with self.lock:
             try:
                 c = self.conn.cursor()
-                c.execute('''CREATE TABLE IF NOT EXISTS welcome_messages (
+                c.execute(f'''CREATE TABLE IF NOT EXISTS welcome_messages (
                              chat_id INTEGER PRIMARY KEY,
                              message TEXT,
-                             image_url TEXT DEFAULT ?)''', (DEFAULT_WELCOME_IMAGE,))
+                             image_url TEXT DEFAULT '{DEFAULT_WELCOME_IMAGE}')''')
                 c.execute('''CREATE TABLE IF NOT EXISTS goodbye_messages (
                              chat_id INTEGER PRIMARY KEY,
                              message TEXT)''')
@@ -65,135 +104,709 @@ class Database:
                              votes TEXT,
                              voters TEXT,
                              created_at REAL)''')
+                c.execute(f'''CREATE TABLE IF NOT EXISTS chat_settings (
+                             chat_id INTEGER PRIMARY KEY,
+                             auto_management BOOLEAN DEFAULT 1,
+                             welcome_enabled BOOLEAN DEFAULT 1,
+                             goodbye_enabled BOOLEAN DEFAULT 1,
+                             welcome_message TEXT,
+                             welcome_image TEXT DEFAULT '{DEFAULT_WELCOME_IMAGE}',
+                             goodbye_message TEXT)''')
+                c.execute('''CREATE TABLE IF NOT EXISTS toxicity_verdicts (
+                             fingerprint TEXT PRIMARY KEY,
+                             toxic BOOLEAN,
+                             expires_at REAL)''')
+                c.execute("CREATE INDEX IF NOT EXISTS idx_toxicity_verdicts_expiry ON toxicity_verdicts (expires_at)")
+                c.execute('''CREATE TABLE IF NOT EXISTS ask_responses (
+                             key TEXT PRIMARY KEY,
+                             response TEXT,
+                             expires_at REAL)''')
+                c.execute("CREATE INDEX IF NOT EXISTS idx_ask_responses_expiry ON ask_responses (expires_at)")
+                c.execute('''CREATE TABLE IF NOT EXISTS welcome_templates (
+                             id INTEGER PRIMARY KEY AUTOINCREMENT,
+                             language TEXT,
+                             template TEXT)''')
+                c.execute("CREATE INDEX IF NOT EXISTS idx_welcome_templates_language ON welcome_templates (language)")
+                c.execute('''CREATE TABLE IF NOT EXISTS global_bans (
+                             user_id INTEGER PRIMARY KEY,
+                             reason TEXT,
+                             banned_by INTEGER,
+                             banned_at REAL)''')
+                c.execute('''CREATE TABLE IF NOT EXISTS poll_votes (
+                             msg_id INTEGER,
+                             user_id INTEGER,
+                             option_index INTEGER,
+                             PRIMARY KEY (msg_id, user_id))''')
+                c.execute('''CREATE TABLE IF NOT EXISTS poll_tallies (
+                             msg_id INTEGER,
+                             option_index INTEGER,
+                             votes INTEGER DEFAULT 0,
+                             PRIMARY KEY (msg_id, option_index))''')
+                # Tallies are maintained in the same statement as the vote insert
+                c.execute('''CREATE TRIGGER IF NOT EXISTS poll_votes_tally AFTER INSERT ON poll_votes
+                             WHEN NEW.option_index IS NOT NULL BEGIN
+                                 INSERT INTO poll_tallies VALUES (NEW.msg_id, NEW.option_index, 1)
+                                 ON CONFLICT(msg_id, option_index) DO UPDATE SET votes = votes + 1;
+                             END''')
+                c.execute('''CREATE TRIGGER IF NOT EXISTS polls_cleanup AFTER DELETE ON polls BEGIN
+                                 DELETE FROM poll_votes WHERE msg_id = OLD.msg_id;
+                                 DELETE FROM poll_tallies WHERE msg_id = OLD.msg_id;
+                             END''')
+                c.execute('''CREATE TABLE IF NOT EXISTS departed_chats (
+                             chat_id INTEGER PRIMARY KEY,
+                             left_at REAL)''')
+                self.migrate(c)
                 self.conn.commit()
+                if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                    # Files created before incremental auto-vacuum need one full VACUUM to switch, or compact frees nothing
+                    self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                    self.conn.execute("VACUUM")
+                    logger.info("Converted database to incremental auto-vacuum")
                 logger.info("Database tables initialized")
             except sqlite3.Error as e:
                 logger.error(f"Database initialization error: {e}")
                 raise
 
+    def migrate(self, c):
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            # Fold the per-feature settings tables into chat_settings
+            c.execute(f'''INSERT OR IGNORE INTO chat_settings (chat_id, auto_management, welcome_enabled, goodbye_enabled,
+                                                           welcome_message, welcome_image, goodbye_message)
+                         SELECT ids.chat_id,
+                                COALESCE(am.enabled, 1), COALESCE(wt.enabled, 1), COALESCE(gt.enabled, 1),
+                                wm.message, COALESCE(wm.image_url, '{DEFAULT_WELCOME_IMAGE}'), gm.message
+                         FROM (SELECT chat_id FROM auto_management UNION SELECT chat_id FROM welcome_toggles
+                               UNION SELECT chat_id FROM goodbye_toggles UNION SELECT chat_id FROM welcome_messages
+                               UNION SELECT chat_id FROM goodbye_messages) ids
+                         LEFT JOIN auto_management am ON am.chat_id = ids.chat_id
+                         LEFT JOIN welcome_toggles wt ON wt.chat_id = ids.chat_id
+                         LEFT JOIN goodbye_toggles gt ON gt.chat_id = ids.chat_id
+                         LEFT JOIN welcome_messages wm ON wm.chat_id = ids.chat_id
+                         LEFT JOIN goodbye_messages gm ON gm.chat_id = ids.chat_id''')
+            logger.info(f"Migrated settings for {c.rowcount} chats into chat_settings")
+            c.execute("PRAGMA user_version = 1")
+        if version < 2:
+            # Legacy polls kept votes/voters as JSON blobs; the voter->option mapping was never stored
+            c.execute('''INSERT OR IGNORE INTO poll_tallies
+                         SELECT p.msg_id, CAST(j.key AS INTEGER), j.value FROM polls p, json_each(p.votes) j
+                         WHERE p.votes IS NOT NULL''')
+            c.execute('''INSERT OR IGNORE INTO poll_votes
+                         SELECT p.msg_id, j.value, NULL FROM polls p, json_each(p.voters) j
+                         WHERE p.voters IS NOT NULL''')
+            c.execute("UPDATE polls SET votes = NULL, voters = NULL")
+            logger.info("Migrated poll votes into poll_votes")
+            c.execute("PRAGMA user_version = 2")
+        if version < 3:
+            # NULL means the global FLOOD_LIMIT / FLOOD_WINDOW apply
+            columns = {row[1] for row in c.execute("PRAGMA table_info(chat_settings)")}
+            for column in ('flood_limit', 'flood_window'):
+                if column not in columns:
+                    c.execute(f"ALTER TABLE chat_settings ADD COLUMN {column} INTEGER")
+            c.execute("PRAGMA user_version = 3")
+        if version < 4:
+            # NULL means the global TOXICITY_CLEAN_BELOW / TOXICITY_TOXIC_AT apply
+            columns = {row[1] for row in c.execute("PRAGMA table_info(chat_settings)")}
+            for column in ('toxicity_clean', 'toxicity_toxic'):
+                if column not in columns:
+                    c.execute(f"ALTER TABLE chat_settings ADD COLUMN {column} REAL")
+            c.execute("PRAGMA user_version = 4")
+        if version < 5:
+            # NULL means WELCOME_LANGUAGE applies
+            columns = {row[1] for row in c.execute("PRAGMA table_info(chat_settings)")}
+            if 'language' not in columns:
+                c.execute("ALTER TABLE chat_settings ADD COLUMN language TEXT")
+            c.execute("PRAGMA user_version = 5")
+        if version < 6:
+            # NULL means GLOBAL_BANS_DEFAULT applies
+            columns = {row[1] for row in c.execute("PRAGMA table_info(chat_settings)")}
+            if 'global_bans' not in columns:
+                c.execute("ALTER TABLE chat_settings ADD COLUMN global_bans BOOLEAN")
+            c.execute("PRAGMA user_version = 6")
+        if version < 7:
+            # NULL means /ask answers are cached
+            columns = {row[1] for row in c.execute("PRAGMA table_info(chat_settings)")}
+            if 'ask_cache' not in columns:
+                c.execute("ALTER TABLE chat_settings ADD COLUMN ask_cache BOOLEAN")
+            c.execute("PRAGMA user_version = 7")
+
+    def _record(self, conn, query, params, start, rows):
+        if self.query_stats:
+            self.query_stats.record(conn, query, params, time.perf_counter() - start, rows)
+
     def execute(self, query, params=()):
         with self.lock:
             try:
+                start = time.perf_counter()
                 c = self.conn.cursor()
                 c.execute(query, params)
                 self.conn.commit()
+                self._record(self.conn, query, params, start, max(c.rowcount, 0))
                 return c
             except sqlite3.Error as e:
                 logger.error(f"Database error: {query} - {e}")
                 return None
 
+    def executemany(self, query, seq_of_params):
+        with self.lock:
+            try:
+                start = time.perf_counter()
+                c = self.conn.executemany(query, seq_of_params)
+                self.conn.commit()
+                self._record(self.conn, query, seq_of_params[0] if seq_of_params else (), start, max(c.rowcount, 0))
+                return c
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                logger.error(f"Database error: {query} - {e}")
+                return None
+
+    def execute_returning(self, query, params=()):
+        # The RETURNING row is read before the commit, under the same lock as the write
+        with self.lock:
+            try:
+                start = time.perf_counter()
+                row = self.conn.execute(query, params).fetchone()
+                self.conn.commit()
+                self._record(self.conn, query, params, start, 0 if row is None else 1)
+                return row
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                logger.error(f"Database error: {query} - {e}")
+                return None
+
     def fetchone(self, query, params=()):
         c = self.execute(query, params)
-        return c.fetchone() if c else None
+        row = c.fetchone() if c else None
+        if self.query_stats and row is not None:
+            self.query_stats.add_rows(query, 1)
+        return row
 
     def fetchall(self, query, params=()):
         c = self.execute(query, params)
-        return c.fetchall() if c else []
+        rows = c.fetchall() if c else []
+        if self.query_stats:
+            self.query_stats.add_rows(query, len(rows))
+        return rows
+
+    def _write(self, query, params):
+        c = self.execute(query, params)
+        return c.rowcount if c else None
+
+    def _write_many(self, query, seq_of_params):
+        c = self.executemany(query, seq_of_params)
+        return c.rowcount if c else None
+
+    def _fetch(self, conn, query, params, one):
+        start = time.perf_counter()
+        c = conn.execute(query, params)
+        if one:
+            res = c.fetchone()
+            self._record(conn, query, params, start, 0 if res is None else 1)
+        else:
+            res = c.fetchall()
+            self._record(conn, query, params, start, len(res))
+        return res
+
+    def _read(self, query, params, one):
+        try:
+            if self.in_memory:
+                with self.lock:
+                    return self._fetch(self.conn, query, params, one)
+            return self._fetch(self._reader_conn(), query, params, one)
+        except sqlite3.Error as e:
+            logger.error(f"Database error: {query} - {e}")
+            return None if one else []
+
+    async def aexecute(self, query, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.writer, self._write, query, params)
+
+    async def aexecutemany(self, query, seq_of_params):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.writer, self._write_many, query, list(seq_of_params))
+
+    async def aexecute_returning(self, query, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.writer, self.execute_returning, query, params)
+
+    async def afetchone(self, query, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.reader, self._read, query, params, True)
+
+    async def afetchall(self, query, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.reader, self._read, query, params, False)
+
+    async def arun(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.writer, fn, *args)
+
+    def compact(self, pages):
+        with self.lock:
+            page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+            before = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                self.conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            self.conn.execute("PRAGMA optimize")
+            after = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            return (before - after) * page_size
+
+    def backup(self, path, pages, sleep):
+        target = sqlite3.connect(path)
+        try:
+            if self.in_memory:
+                # There is no file to open a second connection on, so copy in one step while writes wait
+                with self.lock:
+                    self.conn.backup(target)
+                return
+            # A dedicated read-only connection holds one WAL snapshot for the whole copy: the writer thread keeps
+            # its connection to itself, and commits made meanwhile neither block nor restart the backup
+            source = self._connect()
+            try:
+                source.execute("PRAGMA query_only=ON")
+                source.execute("BEGIN")
+                source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                source.backup(target, pages=pages, sleep=sleep)
+            finally:
+                source.close()
+        finally:
+            target.close()
 
     def close(self):
+        if self.conn is None:
+            return
+        self.stats_buffer.flush_sync()
+        self.writer.shutdown(wait=True)
+        self.reader.shutdown(wait=True)
         with self.lock:
+            for conn in self.reader_conns:
+                conn.close()
+            self.reader_conns.clear()
             self.conn.close()
+            self.conn = None
             logger.info("Database connection closed")
 
+class QueryStats:
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, samples=1024):
+        self.slow_query_ms = slow_query_ms
+        self.samples = samples
+        self.statements = {}
+        self.lock = Lock()
+
+    @staticmethod
+    @lru_cache(maxsize=2048)
+    def normalize(query):
+        query = re.sub(r"'(?:[^']|'')*'", "?", query)
+        query = re.sub(r"\b\d+(?:\.\d+)?\b", "?", query)
+        query = re.sub(r"\s+", " ", query).strip()
+        return re.sub(r"\(\?(?:, \?)+\)", "(?, ...)", query)
+
+    def _entry(self, key):
+        entry = self.statements.get(key)
+        if entry is None:
+            entry = self.statements[key] = {'calls': 0, 'total': 0.0, 'rows': 0, 'latencies': deque(maxlen=self.samples)}
+        return entry
+
+    def record(self, conn, query, params, elapsed, rows):
+        key = self.normalize(query)
+        with self.lock:
+            entry = self._entry(key)
+            entry['calls'] += 1
+            entry['total'] += elapsed
+            entry['rows'] += rows
+            entry['latencies'].append(elapsed)
+        if elapsed * 1000 >= self.slow_query_ms and not query.lstrip().upper().startswith(("PRAGMA", "EXPLAIN")):
+            try:
+                plan = "; ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params))
+            except sqlite3.Error as e:
+                plan = f"unavailable ({e})"
+            logger.warning(f"Slow query ({elapsed * 1000:.1f} ms): {key} | plan: {plan}")
+
+    def add_rows(self, query, rows):
+        with self.lock:
+            self._entry(self.normalize(query))['rows'] += rows
+
+    def snapshot(self):
+        with self.lock:
+            items = [(key, dict(entry, latencies=sorted(entry['latencies']))) for key, entry in self.statements.items()]
+        stats = []
+        for key, entry in items:
+            latencies = entry['latencies']
+            pick = lambda p: latencies[int(p * (len(latencies) - 1))] * 1000 if latencies else 0.0
+            stats.append({
+                'query': key,
+                'calls': entry['calls'],
+                'total_ms': entry['total'] * 1000,
+                'p50_ms': pick(0.5),
+                'p95_ms': pick(0.95),
+                'p99_ms': pick(0.99),
+                'rows': entry['rows'],
+            })
+        return sorted(stats, key=lambda stat: stat['total_ms'], reverse=True)
+
+    def reset(self):
+        with self.lock:
+            self.statements.clear()
+
+class StatsBuffer:
+    UPSERT = ("INSERT INTO user_stats (chat_id, user_id, message_count) VALUES (?, ?, ?) "
+              "ON CONFLICT(chat_id, user_id) DO UPDATE SET message_count = message_count + excluded.message_count")
+
+    def __init__(self, db, flush_interval=STATS_FLUSH_INTERVAL, flush_size=STATS_FLUSH_SIZE):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.pending = defaultdict(int)
+        self.flushing = {}
+        self.updates = 0
+        self.flush_lock = asyncio.Lock()
+        self.task = None
+
+    def add(self, chat_id, user_id):
+        self.pending[(chat_id, user_id)] += 1
+        self.updates += 1
+        return self.updates >= self.flush_size and not self.flush_lock.locked()
+
+    def pending_for(self, chat_id, user_id):
+        key = (chat_id, user_id)
+        return self.pending.get(key, 0) + self.flushing.get(key, 0)
+
+    def _take(self):
+        batch, self.pending = self.pending, defaultdict(int)
+        self.updates = 0
+        return batch
+
+    def _restore(self, batch):
+        for key, delta in batch.items():
+            self.pending[key] += delta
+
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.pending:
+                return 0
+            self.flushing = self._take()
+            rows = [(chat_id, user_id, delta) for (chat_id, user_id), delta in self.flushing.items()]
+            written = False
+            try:
+                written = await self.db.aexecutemany(self.UPSERT, rows) is not None
+            finally:
+                batch, self.flushing = self.flushing, {}
+                if not written:
+                    self._restore(batch)
+            if not written:
+                return 0
+            logger.info(f"Flushed {len(rows)} message counters")
+            return len(rows)
+
+    def flush_sync(self):
+        batch = self._take()
+        if batch and self.db.executemany(self.UPSERT, [(c, u, d) for (c, u), d in batch.items()]) is None:
+            self._restore(batch)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.shield(self.flush())
+            except Exception as e:
+                logger.error(f"Stats flush error: {e}")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+class LRUCache:
+    def __init__(self, max_size=SETTINGS_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.generation = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value, generation):
+        # Skip fills that raced with an invalidation
+        if generation != self.generation:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self.generation += 1
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+
 # Database Functions
-def get_welcome_message(db, chat_id):
-    res = db.fetchone("SELECT message, image_url FROM welcome_messages WHERE chat_id=?", (chat_id,))
-    return (res['message'], res['image_url']) if res else (None, DEFAULT_WELCOME_IMAGE)
+CHAT_SETTINGS_DEFAULTS = {
+    'auto_management': True,
+    'welcome_enabled': True,
+    'goodbye_enabled': True,
+    'welcome_message': None,
+    'welcome_image': DEFAULT_WELCOME_IMAGE,
+    'goodbye_message': None,
+    'flood_limit': FLOOD_LIMIT,
+    'flood_window': FLOOD_WINDOW,
+    'toxicity_clean': TOXICITY_CLEAN_BELOW,
+    'toxicity_toxic': TOXICITY_TOXIC_AT,
+    'language': WELCOME_LANGUAGE,
+    'global_bans': GLOBAL_BANS_DEFAULT,
+    'ask_cache': True,
+}
+
+async def get_chat_settings(db, chat_id):
+    settings = db.settings_cache.get(chat_id)
+    if settings is not None:
+        return settings
+    generation = db.settings_cache.generation
+    res = await db.afetchone("SELECT * FROM chat_settings WHERE chat_id=?", (chat_id,))
+    settings = dict(CHAT_SETTINGS_DEFAULTS)
+    if res:
+        settings.update({key: res[key] for key in CHAT_SETTINGS_DEFAULTS if res[key] is not None})
+        for key in ('auto_management', 'welcome_enabled', 'goodbye_enabled', 'global_bans', 'ask_cache'):
+            settings[key] = bool(settings[key])
+    db.settings_cache.put(chat_id, settings, generation)
+    return settings
+
+async def update_chat_settings(db, chat_id, **values):
+    columns = [key for key in values if key in CHAT_SETTINGS_DEFAULTS]
+    await db.aexecute(
+        f"INSERT INTO chat_settings (chat_id, {', '.join(columns)}) VALUES (?{', ?' * len(columns)}) "
+        f"ON CONFLICT(chat_id) DO UPDATE SET {', '.join(f'{key}=excluded.{key}' for key in columns)}",
+        (chat_id, *(values[key] for key in columns))
+    )
+    db.settings_cache.invalidate(chat_id)
 
-def set_welcome_message(db, chat_id, msg, image_url=None):
-    db.execute("INSERT OR REPLACE INTO welcome_messages VALUES (?, ?, ?)", (chat_id, msg, image_url or DEFAULT_WELCOME_IMAGE))
+async def get_welcome_message(db, chat_id):
+    settings = await get_chat_settings(db, chat_id)
+    return settings['welcome_message'], settings['welcome_image']
 
-def delete_welcome_message(db, chat_id):
-    db.execute("DELETE FROM welcome_messages WHERE chat_id=?", (chat_id,))
+async def set_welcome_message(db, chat_id, msg, image_url=None):
+    await update_chat_settings(db, chat_id, welcome_message=msg, welcome_image=image_url or DEFAULT_WELCOME_IMAGE)
 
-def get_goodbye_message(db, chat_id):
-    res = db.fetchone("SELECT message FROM goodbye_messages WHERE chat_id=?", (chat_id,))
-    return res['message'] if res else None
+async def delete_welcome_message(db, chat_id):
+    await update_chat_settings(db, chat_id, welcome_message=None, welcome_image=DEFAULT_WELCOME_IMAGE)
 
-def set_goodbye_message(db, chat_id, msg):
-    db.execute("INSERT OR REPLACE INTO goodbye_messages VALUES (?, ?)", (chat_id, msg))
+async def get_goodbye_message(db, chat_id):
+    return (await get_chat_settings(db, chat_id))['goodbye_message']
 
-def delete_goodbye_message(db, chat_id):
-    db.execute("DELETE FROM goodbye_messages WHERE chat_id=?", (chat_id,))
+async def set_goodbye_message(db, chat_id, msg):
+    await update_chat_settings(db, chat_id, goodbye_message=msg)
 
-def toggle_welcome(db, chat_id, status):
-    db.execute("INSERT OR REPLACE INTO welcome_toggles VALUES (?, ?)", (chat_id, status))
+async def delete_goodbye_message(db, chat_id):
+    await update_chat_settings(db, chat_id, goodbye_message=None)
 
-def is_welcome_enabled(db, chat_id):
-    res = db.fetchone("SELECT enabled FROM welcome_toggles WHERE chat_id=?", (chat_id,))
-    return bool(res['enabled']) if res else True
+async def toggle_welcome(db, chat_id, status):
+    await update_chat_settings(db, chat_id, welcome_enabled=status)
 
-def toggle_goodbye(db, chat_id, status):
-    db.execute("INSERT OR REPLACE INTO goodbye_toggles VALUES (?, ?)", (chat_id, status))
+async def is_welcome_enabled(db, chat_id):
+    return (await get_chat_settings(db, chat_id))['welcome_enabled']
 
-def is_goodbye_enabled(db, chat_id):
-    res = db.fetchone("SELECT enabled FROM goodbye_toggles WHERE chat_id=?", (chat_id,))
-    return bool(res['enabled']) if res else True
+async def toggle_goodbye(db, chat_id, status):
+    await update_chat_settings(db, chat_id, goodbye_enabled=status)
 
-def toggle_auto_management(db, chat_id, status):
-    db.execute("INSERT OR REPLACE INTO auto_management VALUES (?, ?)", (chat_id, status))
+async def is_goodbye_enabled(db, chat_id):
+    return (await get_chat_settings(db, chat_id))['goodbye_enabled']
 
-def is_auto_management_enabled(db, chat_id):
-    res = db.fetchone("SELECT enabled FROM auto_management WHERE chat_id=?", (chat_id,))
-    return bool(res['enabled']) if res else True
+async def toggle_auto_management(db, chat_id, status):
+    await update_chat_settings(db, chat_id, auto_management=status)
 
-def add_warning(db, user_id, chat_id, reason):
-    res = db.fetchone("SELECT count, banned FROM warnings WHERE chat_id=? AND user_id=?", (chat_id, user_id))
-    count = res['count'] + 1 if res else 1
-    banned = res['banned'] if res else False
-    db.execute("INSERT OR REPLACE INTO warnings VALUES (?, ?, ?, ?, ?)", (chat_id, user_id, count, datetime.now(), banned))
-    return count, banned
+async def is_auto_management_enabled(db, chat_id):
+    return (await get_chat_settings(db, chat_id))['auto_management']
 
-def set_ban_status(db, user_id, chat_id, banned):
-    res = db.fetchone("SELECT count FROM warnings WHERE chat_id=? AND user_id=?", (chat_id, user_id))
-    count = res['count'] if res else 0
-    db.execute("INSERT OR REPLACE INTO warnings VALUES (?, ?, ?, ?, ?)", (chat_id, user_id, count, datetime.now(), banned))
+async def add_warning(db, user_id, chat_id, reason):
+    # One upsert on the writer, so concurrent warnings for the same user all count
+    row = await db.aexecute_returning(
+        "INSERT INTO warnings VALUES (?, ?, 1, ?, 0) ON CONFLICT(chat_id, user_id) "
+        "DO UPDATE SET count = count + 1, last_warn = excluded.last_warn RETURNING count, banned",
+        (chat_id, user_id, datetime.now())
+    )
+    return (row[0], bool(row[1])) if row else (0, False)
 
-def increment_message_count(db, user_id, chat_id):
-    res = db.fetchone("SELECT message_count FROM user_stats WHERE chat_id=? AND user_id=?", (chat_id, user_id))
-    count = res['message_count'] + 1 if res else 1
-    db.execute("INSERT OR REPLACE INTO user_stats VALUES (?, ?, ?)", (chat_id, user_id, count))
-    return count
+async def set_ban_status(db, user_id, chat_id, banned):
+    await db.aexecute(
+        "INSERT INTO warnings VALUES (?, ?, 0, ?, ?) ON CONFLICT(chat_id, user_id) "
+        "DO UPDATE SET last_warn = excluded.last_warn, banned = excluded.banned",
+        (chat_id, user_id, datetime.now(), banned)
+    )
 
-def get_user_stats(db, user_id, chat_id):
-    msg_res = db.fetchone("SELECT message_count FROM user_stats WHERE chat_id=? AND user_id=?", (chat_id, user_id))
-    warn_res = db.fetchone("SELECT count, banned FROM warnings WHERE chat_id=? AND user_id=?", (chat_id, user_id))
-    message_count = msg_res['message_count'] if msg_res else 0
+async def increment_message_count(db, user_id, chat_id):
+    if db.stats_buffer.add(chat_id, user_id):
+        await db.stats_buffer.flush()
+
+async def get_user_stats(db, user_id, chat_id):
+    msg_res = await db.afetchone("SELECT message_count FROM user_stats WHERE chat_id=? AND user_id=?", (chat_id, user_id))
+    warn_res = await db.afetchone("SELECT count, banned FROM warnings WHERE chat_id=? AND user_id=?", (chat_id, user_id))
+    message_count = (msg_res['message_count'] if msg_res else 0) + db.stats_buffer.pending_for(chat_id, user_id)
     warn_count = warn_res['count'] if warn_res else 0
     banned = bool(warn_res['banned']) if warn_res else False
     return message_count, warn_count, banned
 
-def add_verified_user(db, user_id, chat_id):
-    db.execute("INSERT OR REPLACE INTO verified_users VALUES (?, ?)", (chat_id, user_id))
+async def add_verified_user(db, user_id, chat_id):
+    await db.aexecute("INSERT OR REPLACE INTO verified_users VALUES (?, ?)", (chat_id, user_id))
 
-def is_verified_user(db, user_id, chat_id):
-    res = db.fetchone("SELECT 1 FROM verified_users WHERE chat_id=? AND user_id=?", (chat_id, user_id))
+async def is_verified_user(db, user_id, chat_id):
+    res = await db.afetchone("SELECT 1 FROM verified_users WHERE chat_id=? AND user_id=?", (chat_id, user_id))
     return bool(res)
 
-def get_auto_replies(db, chat_id):
-    replies = db.fetchall("SELECT trigger, response FROM auto_replies WHERE chat_id=?", (chat_id,))
+async def get_auto_replies(db, chat_id):
+    replies = await db.afetchall("SELECT trigger, response FROM auto_replies WHERE chat_id=?", (chat_id,))
     return {row['trigger']: row['response'] for row in replies}
 
-def add_auto_reply(db, chat_id, trigger, response):
-    db.execute("INSERT OR REPLACE INTO auto_replies VALUES (?, ?, ?)", (chat_id, trigger.lower(), response))
+async def add_auto_reply(db, chat_id, trigger, response):
+    await db.aexecute("INSERT OR REPLACE INTO auto_replies VALUES (?, ?, ?)", (chat_id, normalize_trigger(trigger), response))
+
+async def remove_auto_reply(db, chat_id, trigger):
+    await db.aexecute("DELETE FROM auto_replies WHERE chat_id=? AND trigger=?", (chat_id, normalize_trigger(trigger)))
+
+async def save_poll(db, msg_id, poll_data):
+    await db.aexecute("INSERT INTO polls (msg_id, chat_id, question, options, created_at) VALUES (?, ?, ?, ?, ?) "
+                      "ON CONFLICT(msg_id) DO UPDATE SET chat_id=excluded.chat_id, question=excluded.question, "
+                      "options=excluded.options, created_at=excluded.created_at",
+                      (msg_id, poll_data['chat_id'], poll_data['question'], json.dumps(poll_data['options']), poll_data['created_at']))
+
+async def add_poll_vote(db, msg_id, user_id, option_index):
+    # The primary key enforces one vote per user; a duplicate is silently ignored
+    rowcount = await db.aexecute("INSERT OR IGNORE INTO poll_votes VALUES (?, ?, ?)", (msg_id, user_id, option_index))
+    return rowcount == 1
+
+async def delete_poll(db, msg_id):
+    await db.aexecute("DELETE FROM polls WHERE msg_id=?", (msg_id,))
+
+CHAT_TABLES = ('chat_settings', 'warnings', 'user_stats', 'verified_users', 'auto_replies', 'polls',
+               'welcome_messages', 'goodbye_messages', 'welcome_toggles', 'goodbye_toggles', 'auto_management')
+
+async def delete_in_batches(db, table, where, params, batch_size):
+    # Small transactions keep the writer free for handlers between batches
+    deleted = 0
+    while True:
+        rowcount = await db.aexecute(
+            f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)",
+            (*params, batch_size)
+        )
+        if not rowcount:
+            return deleted
+        deleted += rowcount
+        if rowcount < batch_size:
+            return deleted
+        await asyncio.sleep(0)
+
+async def get_toxicity_verdict(db, fingerprint, now):
+    res = await db.afetchone("SELECT toxic FROM toxicity_verdicts WHERE fingerprint=? AND expires_at > ?", (fingerprint, now))
+    return bool(res[0]) if res else None
+
+async def save_toxicity_verdict(db, fingerprint, toxic, expires_at):
+    await db.aexecute("INSERT OR REPLACE INTO toxicity_verdicts VALUES (?, ?, ?)", (fingerprint, toxic, expires_at))
+
+async def purge_expired_verdicts(db, now, batch_size):
+    return await delete_in_batches(db, "toxicity_verdicts", "expires_at <= ?", (now,), batch_size)
+
+async def get_ask_response(db, key, now):
+    res = await db.afetchone("SELECT response FROM ask_responses WHERE key=? AND expires_at > ?", (key, now))
+    return res[0] if res else None
+
+async def save_ask_response(db, key, response, expires_at):
+    await db.aexecute("INSERT OR REPLACE INTO ask_responses VALUES (?, ?, ?)", (key, response, expires_at))
+
+async def purge_expired_ask_responses(db, now, batch_size):
+    return await delete_in_batches(db, "ask_responses", "expires_at <= ?", (now,), batch_size)
+
+async def clear_ask_responses(db, batch_size):
+    return await delete_in_batches(db, "ask_responses", "1", (), batch_size)
+
+async def take_welcome_template(db, language):
+    # Each template is used once, so the pool keeps rotating fresh ones
+    row = await db.aexecute_returning(
+        "DELETE FROM welcome_templates WHERE id = "
+        "(SELECT id FROM welcome_templates WHERE language=? ORDER BY RANDOM() LIMIT 1) RETURNING template",
+        (language,)
+    )
+    return row[0] if row else None
+
+async def add_welcome_templates(db, language, templates):
+    await db.aexecutemany("INSERT INTO welcome_templates (language, template) VALUES (?, ?)",
+                          [(language, template) for template in templates])
+
+async def count_welcome_templates(db, language):
+    res = await db.afetchone("SELECT COUNT(*) FROM welcome_templates WHERE language=?", (language,))
+    return res[0]
+
+async def add_global_bans(db, entries):
+    await db.aexecutemany("INSERT OR REPLACE INTO global_bans VALUES (?, ?, ?, ?)", entries)
+
+async def remove_global_ban(db, user_id):
+    return await db.aexecute("DELETE FROM global_bans WHERE user_id=?", (user_id,)) == 1
+
+async def is_globally_banned(db, user_id):
+    return await db.afetchone("SELECT 1 FROM global_bans WHERE user_id=?", (user_id,)) is not None
+
+async def get_global_ban_ids(db):
+    return [row[0] for row in await db.afetchall("SELECT user_id FROM global_bans")]
+
+async def get_global_bans(db):
+    return [tuple(row) for row in await db.afetchall("SELECT user_id, reason, banned_by, banned_at FROM global_bans ORDER BY banned_at")]
+
+async def mark_chat_departed(db, chat_id, left_at):
+    await db.aexecute("INSERT OR REPLACE INTO departed_chats VALUES (?, ?)", (chat_id, left_at))
+
+async def mark_chat_active(db, chat_id):
+    await db.aexecute("DELETE FROM departed_chats WHERE chat_id=?", (chat_id,))
+
+async def purge_expired_warnings(db, cutoff, batch_size):
+    return await delete_in_batches(db, "warnings", "banned = 0 AND last_warn < ?", (cutoff,), batch_size)
+
+async def purge_departed_chats(db, cutoff, batch_size):
+    rows = await db.afetchall("SELECT chat_id FROM departed_chats WHERE left_at < ?", (cutoff,))
+    deleted = 0
+    for row in rows:
+        for table in CHAT_TABLES:
+            deleted += await delete_in_batches(db, table, "chat_id = ?", (row['chat_id'],), batch_size)
+        await mark_chat_active(db, row['chat_id'])
+        db.settings_cache.invalidate(row['chat_id'])
+    return deleted
+
+async def purge_stale_polls(db, cutoff, batch_size):
+    deleted = await delete_in_batches(db, "polls", "created_at < ?", (cutoff,), batch_size)
+    orphaned = "msg_id NOT IN (SELECT msg_id FROM polls)"
+    deleted += await delete_in_batches(db, "poll_votes", orphaned, (), batch_size)
+    deleted += await delete_in_batches(db, "poll_tallies", orphaned, (), batch_size)
+    return deleted
 
-def remove_auto_reply(db, chat_id, trigger):
-    db.execute("DELETE FROM auto_replies WHERE chat_id=? AND trigger=?", (chat_id, trigger.lower()))
+async def compact(db, pages):
+    return await db.arun(db.compact, pages)
 
-def save_poll(db, msg_id, poll_data):
-    db.execute("INSERT OR REPLACE INTO polls VALUES (?, ?, ?, ?, ?, ?, ?)",
-               (msg_id, poll_data['chat_id'], poll_data['question'], json.dumps(poll_data['options']),
-                json.dumps(dict(poll_data['votes'])), json.dumps(list(poll_data['voters'])), poll_data['created_at']))
+async def backup(db, path, pages, sleep):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, db.backup, path, pages, sleep)
 
 def load_polls(db):
-    polls = db.fetchall("SELECT * FROM polls")
-    return {
+    polls = {
         poll['msg_id']: {
             'chat_id': poll['chat_id'],
             'question': poll['question'],
             'options': json.loads(poll['options']),
-            'votes': defaultdict(int, json.loads(poll['votes'])),
-            'voters': set(json.loads(poll['voters'])),
+            'votes': defaultdict(int),
+            'voters': set(),
             'created_at': poll['created_at']
-        } for poll in polls
+        } for poll in db.fetchall("SELECT msg_id, chat_id, question, options, created_at FROM polls")
     }
+    for row in db.fetchall("SELECT msg_id, option_index, votes FROM poll_tallies"):
+        if row['msg_id'] in polls:
+            polls[row['msg_id']]['votes'][row['option_index']] = row['votes']
+    for row in db.fetchall("SELECT msg_id, user_id FROM poll_votes"):
+        if row['msg_id'] in polls:
+            polls[row['msg_id']]['voters'].add(row['user_id'])
+    return polls
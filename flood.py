@@ -0,0 +1,46 @@
+import time
+from collections import OrderedDict
+from config import FLOOD_LIMIT, FLOOD_WINDOW, FLOOD_MAX_KEYS, FLOOD_MAX_WINDOW
+
+class FloodLimiter:
+    # Token bucket per (user, chat): `limit` messages of burst, refilled over `window` seconds
+    def __init__(self, max_keys=FLOOD_MAX_KEYS, idle_after=FLOOD_MAX_WINDOW, sweep_interval=60):
+        self.max_keys = max_keys
+        self.idle_after = idle_after
+        self.sweep_interval = sweep_interval
+        # Ordered by last activity, so idle keys are always at the front
+        self.keys = OrderedDict()
+        self.last_sweep = 0.0
+
+    def hit(self, user_id, chat_id, limit=FLOOD_LIMIT, window=FLOOD_WINDOW, now=None):
+        now = time.monotonic() if now is None else now
+        key = (user_id, chat_id)
+        bucket = self.keys.get(key)
+        if bucket is None:
+            tokens = limit
+            if len(self.keys) >= self.max_keys:
+                self.keys.popitem(last=False)
+        else:
+            tokens = min(limit, bucket[0] + (now - bucket[1]) * limit / window)
+            self.keys.move_to_end(key)
+        flooded = tokens < 1
+        self.keys[key] = (tokens if flooded else tokens - 1, now)
+        if now - self.last_sweep >= self.sweep_interval:
+            self.sweep(now)
+        return flooded
+
+    def sweep(self, now=None):
+        # A bucket idle for idle_after (>= any chat's window) is full again, so dropping it loses nothing
+        now = time.monotonic() if now is None else now
+        removed = 0
+        while self.keys:
+            key, (_, last) = next(iter(self.keys.items()))
+            if now - last < self.idle_after:
+                break
+            del self.keys[key]
+            removed += 1
+        self.last_sweep = now
+        return removed
+
+    def __len__(self):
+        return len(self.keys)
@@ -0,0 +1,73 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from config import WELCOME_BATCH_WINDOW, WELCOME_MIN_INTERVAL, RAID_JOIN_THRESHOLD, RAID_WINDOW, RAID_DURATION
+
+logger = logging.getLogger(__name__)
+
+class JoinCoalescer:
+    # Buffers joins per chat so a burst gets one welcome, at most one per min_interval
+    def __init__(self, window=WELCOME_BATCH_WINDOW, min_interval=WELCOME_MIN_INTERVAL,
+                 raid_joins=RAID_JOIN_THRESHOLD, raid_window=RAID_WINDOW, raid_duration=RAID_DURATION):
+        self.window = window
+        self.min_interval = min_interval
+        self.raid_joins = raid_joins
+        self.raid_window = raid_window
+        self.raid_duration = raid_duration
+        self.pending = {}
+        self.last_sent = {}
+        self.joins = {}
+        self.raid_until = {}
+        self.tasks = set()
+
+    def in_raid(self, chat_id, now=None):
+        now = time.monotonic() if now is None else now
+        until = self.raid_until.get(chat_id)
+        if until is not None and until <= now:
+            del self.raid_until[chat_id]
+            return False
+        return until is not None
+
+    def record_joins(self, chat_id, count, now):
+        # Returns True when this burst pushes the chat into raid mode
+        if not self.raid_joins:
+            return False
+        joins = self.joins.setdefault(chat_id, deque())
+        joins.extend([now] * count)
+        while joins and now - joins[0] > self.raid_window:
+            joins.popleft()
+        if len(joins) < self.raid_joins or chat_id in self.raid_until:
+            return False
+        self.raid_until[chat_id] = now + self.raid_duration
+        self.pending.pop(chat_id, None)
+        joins.clear()
+        logger.warning(f"Raid mode enabled in chat {chat_id}")
+        return True
+
+    def add(self, chat_id, members, send):
+        # send(chat_id, members) is awaited once per flushed burst; returns True if raid mode just started
+        now = time.monotonic()
+        raid_started = self.record_joins(chat_id, len(members), now)
+        if raid_started or self.in_raid(chat_id, now):
+            return raid_started
+        if chat_id in self.pending:
+            self.pending[chat_id].extend(members)
+            return False
+        self.pending[chat_id] = list(members)
+        delay = max(self.window, self.last_sent.get(chat_id, -self.min_interval) + self.min_interval - now)
+        task = asyncio.create_task(self.deliver(chat_id, delay, send))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return False
+
+    async def deliver(self, chat_id, delay, send):
+        await asyncio.sleep(delay)
+        members = self.pending.pop(chat_id, None)
+        if not members:
+            return
+        self.last_sent[chat_id] = time.monotonic()
+        try:
+            await send(chat_id, members)
+        except Exception as e:
+            logger.error(f"Welcome error in chat {chat_id}: {e}")
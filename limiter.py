@@ -0,0 +1,136 @@
+import time
+import asyncio
+import logging
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from config import (AI_CONCURRENCY_INITIAL, AI_CONCURRENCY_MIN, AI_CONCURRENCY_MAX, AI_LATENCY_TARGET,
+                    AI_INTERACTIVE_WEIGHT)
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BACKGROUND = "interactive", "background"
+
+class Slot:
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.started = time.monotonic()
+        self.recorded = False
+
+    def record(self, status):
+        # status is the HTTP status once response headers arrive, or None for a failed request; first call counts
+        if not self.recorded:
+            self.recorded = True
+            self.limiter.observe(self.started, time.monotonic() - self.started, status)
+
+class AdaptiveLimiter:
+    # AIMD: the limit creeps up by one per limit's worth of fast answers while it is the bottleneck, and halves on
+    # 429s, 5xx errors, failures or answers slower than latency_target (once per round of requests)
+    def __init__(self, initial=AI_CONCURRENCY_INITIAL, min_limit=AI_CONCURRENCY_MIN, max_limit=AI_CONCURRENCY_MAX,
+                 latency_target=AI_LATENCY_TARGET, interactive_weight=AI_INTERACTIVE_WEIGHT):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.interactive_weight = interactive_weight
+        self.active = 0
+        self.waiting = 0
+        # lane -> chat_id -> waiters; chats take turns within a lane
+        self.lanes = {INTERACTIVE: OrderedDict(), BACKGROUND: OrderedDict()}
+        self.streak = 0
+        self.decreased_at = float('-inf')
+        self.granted = Counter()
+        self.overloads = Counter()
+        self.increases = self.decreases = 0
+
+    def busy(self):
+        return self.waiting > 0 or self.active >= int(self.limit)
+
+    @asynccontextmanager
+    async def slot(self, chat_id=None, lane=BACKGROUND):
+        await self.acquire(chat_id, lane)
+        try:
+            yield Slot(self)
+        finally:
+            self.release()
+
+    async def acquire(self, chat_id=None, lane=BACKGROUND):
+        if not self.busy():
+            self.active += 1
+            self.granted[lane] += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.lanes[lane].setdefault(chat_id, deque()).append(future)
+        self.waiting += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                self.discard(lane, chat_id, future)
+            else:
+                # Granted just as the caller gave up; pass the slot on
+                self.release()
+            raise
+
+    def discard(self, lane, chat_id, future):
+        queue = self.lanes[lane].get(chat_id)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.waiting -= 1
+            if not queue:
+                del self.lanes[lane][chat_id]
+
+    def release(self):
+        self.active -= 1
+        self.dispatch()
+
+    def next_lane(self):
+        # Interactive requests go first, but background work still gets one slot per interactive_weight grants
+        interactive, background = self.lanes[INTERACTIVE], self.lanes[BACKGROUND]
+        if interactive and (not background or self.streak < self.interactive_weight):
+            self.streak += 1
+            return INTERACTIVE
+        self.streak = 0
+        return BACKGROUND
+
+    def dispatch(self):
+        while self.waiting and self.active < int(self.limit):
+            lane = self.next_lane()
+            chats = self.lanes[lane]
+            chat_id, queue = next(iter(chats.items()))
+            future = queue.popleft()
+            if queue:
+                chats.move_to_end(chat_id)
+            else:
+                del chats[chat_id]
+            self.waiting -= 1
+            if future.cancelled():
+                continue
+            self.active += 1
+            self.granted[lane] += 1
+            future.set_result(None)
+
+    def observe(self, started, latency, status):
+        if status is None or status == 429 or status >= 500 or latency > self.latency_target:
+            self.overloads['failed' if status is None else 'slow' if status < 429 else status] += 1
+            # Requests already in flight when the limit dropped report the same overload; don't halve again
+            if started > self.decreased_at:
+                self.limit = max(self.min_limit, self.limit / 2)
+                self.decreased_at = time.monotonic()
+                self.decreases += 1
+                logger.warning(f"AI concurrency limit lowered to {int(self.limit)} (status {status}, {latency:.1f}s)")
+        elif self.active >= int(self.limit) and self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.increases += 1
+            self.dispatch()
+
+    def stats(self):
+        return {
+            'limit': int(self.limit),
+            'active': self.active,
+            'waiting': self.waiting,
+            'interactive': self.granted[INTERACTIVE],
+            'background': self.granted[BACKGROUND],
+            'increases': self.increases,
+            'decreases': self.decreases,
+            'overloads': dict(self.overloads),
+        }
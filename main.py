@@ -1,13 +1,19 @@
 import os
+import asyncio
 import logging
 from pyrogram import Client
 from config import API_ID, API_HASH, BOT_TOKEN
 from keep_alive import keep_alive
-from database import Database
+from storage import create_storage
+from maintenance import maintenance_loop
+from backup import backup_loop
+from welcomes import welcome_pool
+from ai import deepseek
 from commands import register_command_handlers
 from ui import register_callback_handlers
-from moderation import register_moderation_handlers
+from moderation import register_moderation_handlers, moderation_pipeline, global_bans
 from polls import register_poll_handlers
+from admins import register_admin_handlers
 
 logging.basicConfig(
     filename='bot.log',
@@ -16,7 +22,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-db = Database('group_manager.db')
+storage = create_storage()
+background_tasks = []
 
 bot_client = Client(
     name="ustaad_ai_group_manager",
@@ -27,19 +34,31 @@ bot_client = Client(
 )
 
 async def init_bot():
+    storage.start()
+    deepseek.start()
+    await global_bans.load(storage)
+    moderation_pipeline.start()
+    background_tasks.append(asyncio.create_task(maintenance_loop(storage)))
+    background_tasks.append(asyncio.create_task(backup_loop(storage)))
+    background_tasks.append(asyncio.create_task(welcome_pool.run(storage)))
     logger.info("Bot initialized")
 
 async def shutdown_bot():
-    db.close()
+    for task in background_tasks:
+        task.cancel()
+    await moderation_pipeline.stop()
+    await deepseek.close()
+    await storage.close()
     logger.info("Bot shut down")
 
 bot_client.on_startup(init_bot)
 bot_client.on_shutdown(shutdown_bot)
 
-register_command_handlers(bot_client)
-register_callback_handlers(bot_client)
-register_moderation_handlers(bot_client)
-register_poll_handlers(bot_client)
+register_command_handlers(bot_client, storage)
+register_callback_handlers(bot_client, storage)
+register_moderation_handlers(bot_client, storage)
+register_poll_handlers(bot_client, storage)
+register_admin_handlers(bot_client)
 
 if __name__ == "__main__":
     keep_alive()
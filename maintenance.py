@@ -0,0 +1,38 @@
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from config import MAINTENANCE_INTERVAL, MAINTENANCE_BATCH_SIZE, WARNING_RETENTION_DAYS
+from config import DEPARTED_CHAT_RETENTION_DAYS, POLL_RETENTION_HOURS, VACUUM_PAGES
+
+logger = logging.getLogger(__name__)
+
+async def run_maintenance(storage, batch_size=MAINTENANCE_BATCH_SIZE):
+    # A retention of 0 disables that policy
+    started = time.perf_counter()
+    report = {'warnings': 0, 'chat_rows': 0, 'polls': 0, 'verdicts': 0, 'answers': 0, 'reclaimed_bytes': 0}
+    if WARNING_RETENTION_DAYS:
+        cutoff = datetime.now() - timedelta(days=WARNING_RETENTION_DAYS)
+        report['warnings'] = await storage.purge_expired_warnings(cutoff, batch_size)
+    if DEPARTED_CHAT_RETENTION_DAYS:
+        report['chat_rows'] = await storage.purge_departed_chats(time.time() - DEPARTED_CHAT_RETENTION_DAYS * 86400, batch_size)
+    if POLL_RETENTION_HOURS:
+        report['polls'] = await storage.purge_stale_polls(time.time() - POLL_RETENTION_HOURS * 3600, batch_size)
+    report['verdicts'] = await storage.purge_expired_verdicts(time.time(), batch_size)
+    report['answers'] = await storage.purge_expired_ask_responses(time.time(), batch_size)
+    report['reclaimed_bytes'] = await storage.compact(VACUUM_PAGES)
+    report['duration'] = time.perf_counter() - started
+    logger.info(
+        f"Maintenance: removed {report['warnings']} expired warnings, {report['chat_rows']} rows of departed chats, "
+        f"{report['polls']} stale poll rows, {report['verdicts']} expired toxicity verdicts, "
+        f"{report['answers']} expired /ask answers; reclaimed {report['reclaimed_bytes']} bytes in {report['duration']:.2f}s"
+    )
+    return report
+
+async def maintenance_loop(storage, interval=MAINTENANCE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_maintenance(storage)
+        except Exception as e:
+            logger.error(f"Maintenance error: {e}")
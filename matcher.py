@@ -0,0 +1,152 @@
+import re
+import logging
+from collections import deque
+from config import AUTO_REPLY_REGEX_MAX_LENGTH, AUTO_REPLY_REGEX_MAX, AUTO_REPLY_REGEX_MAX_TEXT
+
+logger = logging.getLogger(__name__)
+
+REGEX_PREFIX = "re:"
+WORD_PREFIX = "word:"
+QUANTIFIER = re.compile(r'(?:[*+?]|\{\d*(?:,\d*)?\})[?+]?')
+
+def check_regex(pattern):
+    # Raises re.error for patterns that can backtrack badly. With at most one repeat and no repeated group that
+    # branches, a search is at worst quadratic in the (capped) message length.
+    if not pattern:
+        raise re.error("empty pattern")
+    if len(pattern) > AUTO_REPLY_REGEX_MAX_LENGTH:
+        raise re.error(f"pattern is longer than {AUTO_REPLY_REGEX_MAX_LENGTH} characters")
+    re.compile(pattern)
+    # One flag per open group: whether it repeats or branches inside
+    groups = [False]
+    after_risky_group = False
+    repeats = 0
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        quantifier = QUANTIFIER.match(pattern, i)
+        if quantifier and i:
+            token = quantifier.group()
+            if token[0] != '?' and after_risky_group:
+                raise re.error("nested quantifiers are not allowed")
+            if token[0] != '?' and not re.fullmatch(r'\{\d+\}[?+]?', token):
+                repeats += 1
+                if repeats > 1:
+                    raise re.error("only one repeat (*, + or {m,n}) is allowed")
+                groups[-1] = True
+            after_risky_group = False
+            i = quantifier.end()
+            continue
+        after_risky_group = False
+        if ch == '\\':
+            i += 2
+            continue
+        if ch == '[':
+            # ']' right after '[' or '[^' is a literal
+            i += 1
+            if pattern[i:i + 1] == '^':
+                i += 1
+            if pattern[i:i + 1] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+        elif ch == '(':
+            groups.append(False)
+            if pattern[i + 1:i + 2] == '?':
+                i += 1
+        elif ch == ')':
+            inner = groups.pop()
+            groups[-1] = groups[-1] or inner
+            after_risky_group = inner
+        elif ch == '|':
+            groups[-1] = True
+        i += 1
+
+def normalize_trigger(trigger):
+    # Regex triggers keep their case: lowercasing would turn \S or \W into \s or \w
+    return trigger if trigger.startswith(REGEX_PREFIX) else trigger.lower()
+
+def is_word_char(ch):
+    return ch.isalnum() or ch == '_'
+
+class AhoCorasick:
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for pattern, payload in patterns:
+            state = 0
+            for ch in pattern:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append((len(pattern), payload))
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+        for outputs in self.out:
+            # Longest pattern first when several end at the same position
+            outputs.sort(key=lambda item: -item[0])
+
+    def iter(self, text):
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for end, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, payload in out[state]:
+                yield end, length, payload
+
+class AutoReplyMatcher:
+    # Replies with the trigger whose match ends first in the message; ties go to the longest trigger
+    def __init__(self, replies):
+        literals = []
+        self.regexes = []
+        for trigger, response in replies.items():
+            if trigger.startswith(REGEX_PREFIX):
+                # Triggers stored before check_regex existed are vetted here too
+                try:
+                    if len(self.regexes) >= AUTO_REPLY_REGEX_MAX:
+                        raise re.error(f"more than {AUTO_REPLY_REGEX_MAX} regex triggers")
+                    check_regex(trigger[len(REGEX_PREFIX):])
+                    self.regexes.append((re.compile(trigger[len(REGEX_PREFIX):], re.IGNORECASE), response))
+                except re.error as e:
+                    logger.error(f"Invalid auto-reply regex {trigger}: {e}")
+            elif trigger.startswith(WORD_PREFIX):
+                literals.append((trigger[len(WORD_PREFIX):], (True, response)))
+            elif trigger:
+                literals.append((trigger, (False, response)))
+        self.automaton = AhoCorasick(literals) if literals else None
+
+    def match(self, text):
+        best_end, best = None, None
+        if self.automaton:
+            lowered = text.lower()
+            for end, length, (whole_word, response) in self.automaton.iter(lowered):
+                start = end - length + 1
+                if whole_word and ((start > 0 and is_word_char(lowered[start - 1])) or
+                                   (end + 1 < len(lowered) and is_word_char(lowered[end + 1]))):
+                    continue
+                best_end, best = end, response
+                break
+        for pattern, response in self.regexes:
+            m = pattern.search(text, 0, AUTO_REPLY_REGEX_MAX_TEXT)
+            if m and (best_end is None or m.end() - 1 < best_end):
+                best_end, best = m.end() - 1, response
+        return best
+
+    def __bool__(self):
+        return bool(self.automaton or self.regexes)
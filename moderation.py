@@ -1,34 +1,58 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message
-from database import Database, is_auto_management_enabled, is_welcome_enabled, is_goodbye_enabled
-from database import get_welcome_message, get_goodbye_message, is_verified_user, add_warning, set_ban_status
-from database import increment_message_count, get_auto_replies
-from ai import is_toxic_message, generate_welcome_message
-from config import DEFAULT_WELCOME_IMAGE
+from ai import toxicity_batcher
+from config import DEFAULT_WELCOME_IMAGE, PRIORITY_CHATS, MODERATION_TRUSTED_MESSAGES, WELCOME_MAX_MENTIONS, RAID_DURATION
 from ui import create_keyboard
 import logging
-from collections import defaultdict
+from flood import FloodLimiter
+from toxicity import ToxicityPrefilter, CLEAN, TOXIC, AMBIGUOUS
+from pipeline import ModerationPipeline, HIGH, NORMAL
+from joins import JoinCoalescer
+from spam import SpamIndex
+from welcomes import welcome_pool
+from bans import GlobalBanList
 import time
+from functools import partial
 
 logger = logging.getLogger(__name__)
 
-user_message_timestamps = defaultdict(list)
+flood_limiter = FloodLimiter()
+toxicity_prefilter = ToxicityPrefilter()
+moderation_pipeline = ModerationPipeline()
+join_coalescer = JoinCoalescer()
+spam_index = SpamIndex()
+global_bans = GlobalBanList()
 
-async def check_flood(user_id, chat_id):
-    now = time.time()
-    key = (user_id, chat_id)
-    user_message_timestamps[key].append(now)
-    user_message_timestamps[key] = [t for t in user_message_timestamps[key] if now - t < 30]
-    return len(user_message_timestamps[key]) > 5
+def register_moderation_handlers(client: Client, storage):
+    async def send_welcome(chat_id, members):
+        settings = await storage.get_chat_settings(chat_id)
+        if not settings['auto_management'] or not settings['welcome_enabled']:
+            return
+        shown = members[:WELCOME_MAX_MENTIONS]
+        others = f" and {len(members) - len(shown)} others" if len(members) > len(shown) else ""
+        custom_msg, image_url = settings['welcome_message'], settings['welcome_image']
+        template = custom_msg or await welcome_pool.take(storage, settings['language'])
+        final_msg = template.replace("{name}", ", ".join(member.mention for member in shown) + others)
+        await client.send_photo(chat_id, photo=image_url, caption=final_msg, parse_mode="HTML")
+
+    async def remove_globally_banned(chat_id, user):
+        await client.ban_chat_member(chat_id, user.id)
+        await storage.set_ban_status(user.id, chat_id, True)
+        await client.send_message(chat_id, f"🚫 {user.mention} is on the shared ban list and was removed.", parse_mode="HTML")
 
-def register_moderation_handlers(client: Client):
     @client.on_message(filters.new_chat_members)
     async def welcome_new_member(_, message: Message):
-        db = Database('group_manager.db')
-        if not is_auto_management_enabled(db, message.chat.id) or not is_welcome_enabled(db, message.chat.id):
-            return
+        if any(member.id == client.me.id for member in message.new_chat_members):
+            await storage.mark_chat_active(message.chat.id)
+        settings = await storage.get_chat_settings(message.chat.id)
+        welcome = settings['auto_management'] and settings['welcome_enabled']
+        members = []
         for member in message.new_chat_members:
-            if member.id == client.me.id:
+            if member.id != client.me.id and settings['global_bans'] and await global_bans.is_banned(storage, member.id):
+                await remove_globally_banned(message.chat.id, member)
+            elif not welcome:
+                continue
+            elif member.id == client.me.id:
                 await message.reply_photo(
                     photo=DEFAULT_WELCOME_IMAGE,
                     caption="🙏 Thank you for adding Ustaad AI to this group!\n\n"
@@ -40,46 +64,83 @@ def register_moderation_handlers(client: Client):
                     reply_markup=create_keyboard([("🤖 Try AI Chat", "ai_chat", None)])
                 )
             else:
-                custom_msg, image_url = get_welcome_message(db, message.chat.id)
-                final_msg = custom_msg.replace("{name}", member.first_name) if custom_msg else await generate_welcome_message(member.first_name)
-                await message.reply_photo(photo=image_url, caption=final_msg, parse_mode="HTML")
+                members.append(member)
+        if members and join_coalescer.add(message.chat.id, members, send_welcome):
+            await message.reply(
+                f"🚨 Raid mode on: too many members joined at once. Welcomes are paused for {RAID_DURATION // 60} minutes.",
+                parse_mode="HTML"
+            )
 
     @client.on_message(filters.left_chat_member)
     async def goodbye_member(_, message: Message):
-        db = Database('group_manager.db')
-        if not is_auto_management_enabled(db, message.chat.id) or not is_goodbye_enabled(db, message.chat.id):
+        if message.left_chat_member.id == client.me.id:
+            return await storage.mark_chat_departed(message.chat.id, time.time())
+        settings = await storage.get_chat_settings(message.chat.id)
+        if not settings['auto_management'] or not settings['goodbye_enabled']:
             return
         member = message.left_chat_member
-        goodbye_msg = get_goodbye_message(db, message.chat.id)
+        goodbye_msg = settings['goodbye_message']
         default_msg = f"👋 {member.mention} has left the group."
         final_msg = goodbye_msg.replace("{name}", member.first_name) if goodbye_msg else default_msg
         await message.reply(final_msg, parse_mode="HTML")
 
+    async def punish_toxic(message, reason="Toxic message"):
+        await message.delete()
+        count, _ = await storage.add_warning(message.from_user.id, message.chat.id, reason)
+        await message.reply(
+            f"⚠️ {message.from_user.mention}, your message was removed for being inappropriate. Warning {count}/3.",
+            reply_markup=create_keyboard([("📩 Appeal", "appeal_warning", None)]),
+            parse_mode="HTML"
+        )
+        if count >= 3:
+            await client.ban_chat_member(message.chat.id, message.from_user.id)
+            await storage.set_ban_status(message.from_user.id, message.chat.id, True)
+            await message.reply(f"🚫 {message.from_user.mention} has been banned for reaching 3 warnings.", parse_mode="HTML")
+
+    async def check_with_ai(message):
+        if await storage.classify_toxicity(message.text, partial(toxicity_batcher.classify, chat_id=message.chat.id)):
+            await punish_toxic(message)
+
+    async def route_ambiguous(message):
+        # Queued for the AI unless the queue is overloaded, in which case the check is shed. The prefilter already
+        # removes messages with two strong signals, so a shed message is let through; a local score alone never warns
+        priority = HIGH if message.chat.id in PRIORITY_CHATS else NORMAL
+        if not moderation_pipeline.overloaded(priority) and moderation_pipeline.submit(lambda: check_with_ai(message), priority):
+            return AMBIGUOUS
+        message_count, _, _ = await storage.get_user_stats(message.from_user.id, message.chat.id)
+        if message_count >= MODERATION_TRUSTED_MESSAGES:
+            moderation_pipeline.shed['trusted'] += 1
+            return CLEAN
+        moderation_pipeline.shed['local'] += 1
+        return CLEAN
+
     @client.on_message(filters.text & filters.group)
     async def moderate_message(_, message: Message):
-        db = Database('group_manager.db')
-        if not is_auto_management_enabled(db, message.chat.id):
+        settings = await storage.get_chat_settings(message.chat.id)
+        if settings['global_bans'] and await global_bans.is_banned(storage, message.from_user.id):
+            await message.delete()
+            await remove_globally_banned(message.chat.id, message.from_user)
+            return
+        if not settings['auto_management']:
             return
-        if await check_flood(message.from_user.id, message.chat.id):
+        if flood_limiter.hit(message.from_user.id, message.chat.id, settings['flood_limit'], settings['flood_window']):
             await message.reply("⚠️ Slow down! You're sending messages too fast.", parse_mode="HTML")
             return
-        if not is_verified_user(db, message.from_user.id, message.chat.id):
-            if await is_toxic_message(message.text):
-                await message.delete()
-                count, _ = add_warning(db, message.from_user.id, message.chat.id, "Toxic message")
-                await message.reply(
-                    f"⚠️ {message.from_user.mention}, your message was removed for being inappropriate. Warning {count}/3.",
-                    reply_markup=create_keyboard([("📩 Appeal", "appeal_warning", None)]),
-                    parse_mode="HTML"
-                )
-                if count >= 3:
-                    await client.ban_chat_member(message.chat.id, message.from_user.id)
-                    set_ban_status(db, message.from_user.id, message.chat.id, True)
-                    await message.reply(f"🚫 {message.from_user.mention} has been banned for reaching 3 warnings.", parse_mode="HTML")
+        # Every message feeds the cross-chat index; only unverified senders are acted on
+        spam = spam_index.is_spam(message.text, message.chat.id)
+        if not await storage.is_verified_user(message.from_user.id, message.chat.id):
+            if spam:
+                spam_index.removed += 1
+                await punish_toxic(message, "Cross-chat spam")
+                return
+            verdict, _ = toxicity_prefilter.classify(message.text, message.chat.id, settings['toxicity_clean'], settings['toxicity_toxic'])
+            if verdict == AMBIGUOUS:
+                verdict = await route_ambiguous(message)
+            if verdict == TOXIC:
+                await punish_toxic(message)
                 return
-        increment_message_count(db, message.from_user.id, message.chat.id)
-        auto_replies = get_auto_replies(db, message.chat.id)
-        for trigger, response in auto_replies.items():
-            if trigger.lower() in message.text.lower():
-                await message.reply(response, parse_mode="HTML")
-                break
+        await storage.increment_message_count(message.from_user.id, message.chat.id)
+        matcher = await storage.get_auto_reply_matcher(message.chat.id)
+        response = matcher.match(message.text) if matcher else None
+        if response:
+            await message.reply(response, parse_mode="HTML")
@@ -0,0 +1,76 @@
+import time
+import asyncio
+import logging
+import itertools
+from collections import Counter, deque
+from config import MODERATION_WORKERS, MODERATION_QUEUE_SIZE, MODERATION_SHED_DEPTH
+
+logger = logging.getLogger(__name__)
+
+HIGH, NORMAL = 0, 1
+
+class ModerationPipeline:
+    # Runs AI moderation jobs off the dispatcher; lower priority numbers are served first
+    def __init__(self, workers=MODERATION_WORKERS, max_size=MODERATION_QUEUE_SIZE, shed_depth=MODERATION_SHED_DEPTH):
+        self.workers = workers
+        self.max_size = max_size
+        self.shed_depth = shed_depth
+        self.queue = asyncio.PriorityQueue()
+        self.sequence = itertools.count()
+        self.tasks = []
+        self.waits = deque(maxlen=1000)
+        self.processed = self.rejected = self.failed = self.max_depth = 0
+        # Checks decided without the AI while overloaded, by reason
+        self.shed = Counter()
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def overloaded(self, priority=NORMAL):
+        # High-priority chats only shed once the queue is full
+        return self.depth() >= (self.max_size if priority == HIGH else self.shed_depth)
+
+    def submit(self, job, priority=NORMAL):
+        # job is a zero-argument coroutine function; False means the caller must decide without the queue
+        if self.depth() >= self.max_size:
+            self.rejected += 1
+            return False
+        self.queue.put_nowait((priority, next(self.sequence), time.monotonic(), job))
+        self.max_depth = max(self.max_depth, self.depth())
+        return True
+
+    async def worker(self):
+        while True:
+            _, _, enqueued, job = await self.queue.get()
+            self.waits.append(time.monotonic() - enqueued)
+            try:
+                await job()
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Moderation job error: {e}")
+            finally:
+                self.queue.task_done()
+
+    def stats(self):
+        waits = sorted(self.waits)
+        return {
+            'depth': self.depth(),
+            'max_depth': self.max_depth,
+            'workers': len(self.tasks),
+            'processed': self.processed,
+            'rejected': self.rejected,
+            'failed': self.failed,
+            'shed': dict(self.shed),
+            'wait_avg': sum(waits) / len(waits) if waits else 0.0,
+            'wait_p95': waits[int(len(waits) * 0.95)] if waits else 0.0,
+        }
@@ -1,8 +1,8 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message
-from database import Database, save_poll, load_polls
-from config import DEFAULT_WELCOME_IMAGE
+from config import DEFAULT_WELCOME_IMAGE, POLL_RETENTION_HOURS
 from ui import create_keyboard
+from admins import admin_only
 import logging
 import re
 import json
@@ -14,10 +14,9 @@ logger = logging.getLogger(__name__)
 
 active_polls = {}
 
-def register_poll_handlers(client: Client):
-    db = Database('group_manager.db')
+def register_poll_handlers(client: Client, storage):
     global active_polls
-    active_polls = load_polls(db)
+    active_polls = storage.load_polls()
 
     @client.on_message(filters.command("poll") & filters.group & admin_only())
     async def create_poll(_, message: Message):
@@ -38,6 +37,9 @@ def register_poll_handlers(client: Client):
                     parts.pop(-1)
                 except ValueError:
                     pass
+            # Maintenance purges polls older than the retention, so a poll must end before then
+            if POLL_RETENTION_HOURS and timeout >= POLL_RETENTION_HOURS * 3600:
+                return await message.reply(f"❌ Polls must end within {POLL_RETENTION_HOURS} hours.", parse_mode="HTML")
             options = parts[:10]
             if len(options) < 2:
                 return await message.reply("❌ At least two options required.", parse_mode="HTML")
@@ -57,8 +59,8 @@ def register_poll_handlers(client: Client):
                 "created_at": time.time()
             }
             active_polls[sent_msg.id] = poll_data
-            save_poll(db, sent_msg.id, poll_data)
-            asyncio.create_task(end_poll_after_timeout(sent_msg.id, timeout))
+            await storage.save_poll(sent_msg.id, poll_data)
+            asyncio.create_task(end_poll_after_timeout(client, storage, sent_msg.id, timeout))
         except Exception as e:
             logger.error(f"Poll creation error: {e}")
             await message.reply("❌ Failed to create poll.", parse_mode="HTML")
@@ -72,16 +74,15 @@ def register_poll_handlers(client: Client):
             return await callback_query.answer("❌ This poll has ended.")
         poll = active_polls[poll_msg_id]
         user_id = callback_query.from_user.id
-        if user_id in poll["voters"]:
+        if user_id in poll["voters"] or not await storage.add_poll_vote(poll_msg_id, user_id, option_index):
             return await callback_query.answer("⚠️ You've already voted!")
         poll["votes"][option_index] += 1
         poll["voters"].add(user_id)
-        save_poll(db, poll_msg_id, poll)
         keyboard = create_keyboard([(f"{opt} ({poll['votes'][i]})", f"vote_{i}_{poll_msg_id}", None) for i, opt in enumerate(poll["options"])])
         await callback_query.message.edit_reply_markup(reply_markup=keyboard)
         await callback_query.answer("✅ Voted successfully!")
 
-async def end_poll_after_timeout(msg_id, timeout):
+async def end_poll_after_timeout(client, storage, msg_id, timeout):
     await asyncio.sleep(timeout)
     if msg_id not in active_polls:
         return
@@ -91,12 +92,11 @@ async def end_poll_after_timeout(msg_id, timeout):
     winners = [poll['options'][i] for i in poll['votes'] if poll['votes'][i] == max_vote]
     winner_text = ", ".join(winners) if winners else "No votes"
     try:
-        db = Database('group_manager.db')
-        await bot_client.send_message(
+        await client.send_message(
             poll['chat_id'],
             f"🏁 Poll ended! Winner(s): <b>{winner_text}</b><br><br>Results:<br>{results}",
             parse_mode="HTML"
         )
-        db.execute("DELETE FROM polls WHERE msg_id=?", (msg_id,))
+        await storage.delete_poll(msg_id)
     except Exception as e:
         logger.error(f"Poll end error: {e}")
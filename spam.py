@@ -0,0 +1,122 @@
+import time
+import zlib
+import array
+import itertools
+from collections import OrderedDict
+from toxicity import tokenize
+from config import SPAM_CHAT_THRESHOLD, SPAM_WINDOW, SPAM_SIMILARITY, SPAM_MIN_TOKENS, SPAM_INDEX_MAX
+
+SHINGLE = 5
+BINS = 32
+BANDS = 8
+ROWS = BINS // BANDS
+EMPTY = 0xFFFFFFFF
+
+def minhash(text):
+    # One-permutation MinHash: the low bits of a shingle's CRC pick its bin, which keeps the smallest rest
+    data = text.encode()
+    signature = array.array('I', [EMPTY]) * BINS
+    for i in range(max(1, len(data) - SHINGLE + 1)):
+        slot, value = divmod(zlib.crc32(data[i:i + SHINGLE]), BINS)[::-1]
+        if value < signature[slot]:
+            signature[slot] = value
+    return signature
+
+def similarity(a, b):
+    # Bins empty in both signatures say nothing about overlap; short messages leave many of them
+    matches = total = 0
+    for x, y in zip(a, b):
+        if x != EMPTY or y != EMPTY:
+            total += 1
+            matches += x == y
+    return matches / total if total else 0.0
+
+class SpamIndex:
+    # Near-duplicate messages share a cluster; a cluster seen in enough chats within the window is spam.
+    # Signatures are bucketed by LSH bands, so a lookup only compares against a handful of candidates.
+    def __init__(self, chats=SPAM_CHAT_THRESHOLD, window=SPAM_WINDOW, threshold=SPAM_SIMILARITY,
+                 min_tokens=SPAM_MIN_TOKENS, max_clusters=SPAM_INDEX_MAX):
+        self.chats = chats
+        self.window = window
+        self.threshold = threshold
+        self.min_tokens = min_tokens
+        self.max_clusters = max_clusters
+        # id -> [signature, last_seen, {chat_id: last_seen}], oldest activity first
+        self.clusters = OrderedDict()
+        # band key -> cluster id, or a set of ids once a band is shared
+        self.buckets = {}
+        self.ids = itertools.count()
+        # flagged counts every match; removed only those moderation acted on (verified senders are left alone)
+        self.flagged = self.removed = 0
+
+    def bands(self, signature):
+        # All-empty bands are identical across every short message, so they are not indexed
+        keys = []
+        for band in range(BANDS):
+            rows = signature[band * ROWS:(band + 1) * ROWS]
+            if rows.count(EMPTY) < ROWS:
+                keys.append(hash((band, *rows)))
+        return keys
+
+    def find(self, signature, keys):
+        for key in keys:
+            bucket = self.buckets.get(key)
+            for cluster_id in (bucket,) if isinstance(bucket, int) else bucket or ():
+                if similarity(self.clusters[cluster_id][0], signature) >= self.threshold:
+                    return cluster_id
+        return None
+
+    def observe(self, text, chat_id, now=None):
+        # Returns how many chats sent a near-duplicate of text within the window, including this one
+        now = time.monotonic() if now is None else now
+        tokens = tokenize(text)
+        if len(tokens) < self.min_tokens:
+            return 0
+        self.evict(now)
+        signature = minhash(' '.join(tokens))
+        keys = self.bands(signature)
+        cluster_id = self.find(signature, keys)
+        if cluster_id is None:
+            cluster_id = next(self.ids)
+            self.clusters[cluster_id] = [signature, now, {chat_id: now}]
+            for key in keys:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    self.buckets[key] = cluster_id
+                elif isinstance(bucket, int):
+                    self.buckets[key] = {bucket, cluster_id}
+                else:
+                    bucket.add(cluster_id)
+            return 1
+        cluster = self.clusters[cluster_id]
+        self.clusters.move_to_end(cluster_id)
+        cluster[1] = now
+        seen = cluster[2]
+        seen[chat_id] = now
+        for other in [other for other, last in seen.items() if now - last > self.window]:
+            del seen[other]
+        return len(seen)
+
+    def is_spam(self, text, chat_id, now=None):
+        if self.chats and self.observe(text, chat_id, now) >= self.chats:
+            self.flagged += 1
+            return True
+        return False
+
+    def evict(self, now):
+        while self.clusters:
+            cluster_id, cluster = next(iter(self.clusters.items()))
+            if now - cluster[1] <= self.window and len(self.clusters) < self.max_clusters:
+                break
+            del self.clusters[cluster_id]
+            for key in self.bands(cluster[0]):
+                bucket = self.buckets[key]
+                if isinstance(bucket, int):
+                    del self.buckets[key]
+                else:
+                    bucket.discard(cluster_id)
+                    if len(bucket) == 1:
+                        self.buckets[key] = next(iter(bucket))
+
+    def __len__(self):
+        return len(self.clusters)
@@ -0,0 +1,527 @@
+import time
+import random
+import logging
+from collections import defaultdict
+from datetime import datetime
+import database
+from database import Database, LRUCache, CHAT_SETTINGS_DEFAULTS
+from matcher import AutoReplyMatcher, normalize_trigger
+from toxicity import VerdictCache, fingerprint
+from ai import ask_cache_key, API_STATUS_ERROR, API_ERROR
+from config import DEFAULT_WELCOME_IMAGE, STORAGE_BACKEND, DATABASE_PATH, AUTO_REPLY_CACHE_SIZE, TOXICITY_CACHE_PERSIST
+from config import ASK_CACHE_SIZE, ASK_CACHE_TTL, MAINTENANCE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+class Storage:
+    query_stats = None
+    persist_verdicts = False
+
+    def __init__(self):
+        self.auto_reply_matchers = LRUCache(AUTO_REPLY_CACHE_SIZE)
+        self.toxicity_verdicts = VerdictCache()
+        self.ask_responses = VerdictCache(ASK_CACHE_SIZE, ASK_CACHE_TTL)
+
+    def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get_chat_settings(self, chat_id):
+        raise NotImplementedError
+
+    async def update_chat_settings(self, chat_id, **values):
+        raise NotImplementedError
+
+    async def add_warning(self, user_id, chat_id, reason):
+        raise NotImplementedError
+
+    async def set_ban_status(self, user_id, chat_id, banned):
+        raise NotImplementedError
+
+    async def increment_message_count(self, user_id, chat_id):
+        raise NotImplementedError
+
+    async def get_user_stats(self, user_id, chat_id):
+        raise NotImplementedError
+
+    async def add_verified_user(self, user_id, chat_id):
+        raise NotImplementedError
+
+    async def is_verified_user(self, user_id, chat_id):
+        raise NotImplementedError
+
+    async def get_auto_replies(self, chat_id):
+        raise NotImplementedError
+
+    async def add_auto_reply(self, chat_id, trigger, response):
+        raise NotImplementedError
+
+    async def remove_auto_reply(self, chat_id, trigger):
+        raise NotImplementedError
+
+    async def save_poll(self, msg_id, poll_data):
+        raise NotImplementedError
+
+    async def add_poll_vote(self, msg_id, user_id, option_index):
+        raise NotImplementedError
+
+    async def delete_poll(self, msg_id):
+        raise NotImplementedError
+
+    def load_polls(self):
+        raise NotImplementedError
+
+    async def mark_chat_departed(self, chat_id, left_at):
+        raise NotImplementedError
+
+    async def mark_chat_active(self, chat_id):
+        raise NotImplementedError
+
+    async def purge_expired_warnings(self, cutoff, batch_size):
+        raise NotImplementedError
+
+    async def purge_departed_chats(self, cutoff, batch_size):
+        raise NotImplementedError
+
+    async def purge_stale_polls(self, cutoff, batch_size):
+        raise NotImplementedError
+
+    async def get_toxicity_verdict(self, fingerprint, now):
+        return None
+
+    async def save_toxicity_verdict(self, fingerprint, toxic, expires_at):
+        pass
+
+    async def purge_expired_verdicts(self, now, batch_size):
+        return 0
+
+    async def get_ask_response(self, key, now):
+        return None
+
+    async def save_ask_response(self, key, response, expires_at):
+        pass
+
+    async def purge_expired_ask_responses(self, now, batch_size):
+        return 0
+
+    async def clear_ask_responses(self, batch_size):
+        return 0
+
+    async def take_welcome_template(self, language):
+        raise NotImplementedError
+
+    async def add_global_bans(self, entries):
+        raise NotImplementedError
+
+    async def remove_global_ban(self, user_id):
+        raise NotImplementedError
+
+    async def is_globally_banned(self, user_id):
+        raise NotImplementedError
+
+    async def get_global_ban_ids(self):
+        raise NotImplementedError
+
+    async def get_global_bans(self):
+        raise NotImplementedError
+
+    async def add_welcome_templates(self, language, templates):
+        raise NotImplementedError
+
+    async def count_welcome_templates(self, language):
+        raise NotImplementedError
+
+    async def compact(self, pages):
+        return 0
+
+    async def backup(self, path, pages, sleep):
+        raise NotImplementedError("This storage backend does not support backups")
+
+    # Settings shortcuts shared by every backend
+    async def get_welcome_message(self, chat_id):
+        settings = await self.get_chat_settings(chat_id)
+        return settings['welcome_message'], settings['welcome_image']
+
+    async def set_welcome_message(self, chat_id, msg, image_url=None):
+        await self.update_chat_settings(chat_id, welcome_message=msg, welcome_image=image_url or DEFAULT_WELCOME_IMAGE)
+
+    async def delete_welcome_message(self, chat_id):
+        await self.update_chat_settings(chat_id, welcome_message=None, welcome_image=DEFAULT_WELCOME_IMAGE)
+
+    async def get_goodbye_message(self, chat_id):
+        return (await self.get_chat_settings(chat_id))['goodbye_message']
+
+    async def set_goodbye_message(self, chat_id, msg):
+        await self.update_chat_settings(chat_id, goodbye_message=msg)
+
+    async def delete_goodbye_message(self, chat_id):
+        await self.update_chat_settings(chat_id, goodbye_message=None)
+
+    async def toggle_welcome(self, chat_id, status):
+        await self.update_chat_settings(chat_id, welcome_enabled=status)
+
+    async def toggle_goodbye(self, chat_id, status):
+        await self.update_chat_settings(chat_id, goodbye_enabled=status)
+
+    async def get_auto_reply_matcher(self, chat_id):
+        matcher = self.auto_reply_matchers.get(chat_id)
+        if matcher is None:
+            generation = self.auto_reply_matchers.generation
+            matcher = AutoReplyMatcher(await self.get_auto_replies(chat_id))
+            self.auto_reply_matchers.put(chat_id, matcher, generation)
+        return matcher
+
+    async def classify_toxicity(self, text, classify):
+        # Spam waves repeat the same text, so one verdict serves every copy until it expires
+        verdicts = self.toxicity_verdicts
+        key = fingerprint(text)
+        now = time.time()
+        toxic = verdicts.get(key, now)
+        if toxic is not None:
+            return toxic
+        if self.persist_verdicts:
+            toxic = await self.get_toxicity_verdict(key, now)
+            if toxic is not None:
+                verdicts.persisted_hits += 1
+                verdicts.put(key, toxic, now + verdicts.ttl)
+                return toxic
+        verdicts.misses += 1
+        toxic = await classify(text)
+        if toxic is not None:
+            verdicts.put(key, toxic, now + verdicts.ttl)
+            if self.persist_verdicts:
+                await self.save_toxicity_verdict(key, toxic, now + verdicts.ttl)
+        return toxic
+
+    async def ask_cached(self, question, ask):
+        # FAQ-style questions repeat; the in-memory LRU sits in front of the backend's persisted answers
+        answers = self.ask_responses
+        key = ask_cache_key(question)
+        now = time.time()
+        response = answers.get(key, now)
+        if response is not None:
+            return response
+        response = await self.get_ask_response(key, now)
+        if response is not None:
+            answers.persisted_hits += 1
+            answers.put(key, response, now + answers.ttl)
+            return response
+        answers.misses += 1
+        response = await ask(question)
+        if response not in (API_STATUS_ERROR, API_ERROR):
+            answers.put(key, response, now + answers.ttl)
+            await self.save_ask_response(key, response, now + answers.ttl)
+        return response
+
+    async def purge_ask_responses(self, batch_size=MAINTENANCE_BATCH_SIZE):
+        # Backends that persist answers hold a superset of the memory tier
+        purged = len(self.ask_responses.entries)
+        self.ask_responses.clear()
+        return await self.clear_ask_responses(batch_size) or purged
+
+    async def toggle_ask_cache(self, chat_id, status):
+        await self.update_chat_settings(chat_id, ask_cache=status)
+
+    async def toggle_auto_management(self, chat_id, status):
+        await self.update_chat_settings(chat_id, auto_management=status)
+
+    async def set_flood_limit(self, chat_id, limit, window):
+        await self.update_chat_settings(chat_id, flood_limit=limit, flood_window=window)
+
+    async def toggle_global_bans(self, chat_id, status):
+        await self.update_chat_settings(chat_id, global_bans=status)
+
+    async def set_language(self, chat_id, language):
+        await self.update_chat_settings(chat_id, language=language)
+
+    async def set_toxicity_thresholds(self, chat_id, clean, toxic):
+        await self.update_chat_settings(chat_id, toxicity_clean=clean, toxicity_toxic=toxic)
+
+class SQLiteStorage(Storage):
+    persist_verdicts = TOXICITY_CACHE_PERSIST
+
+    def __init__(self, db):
+        super().__init__()
+        self.db = db
+
+    @property
+    def query_stats(self):
+        return self.db.query_stats
+
+    def start(self):
+        self.db.stats_buffer.start()
+
+    async def close(self):
+        await self.db.stats_buffer.stop()
+        self.db.close()
+
+    async def get_chat_settings(self, chat_id):
+        return await database.get_chat_settings(self.db, chat_id)
+
+    async def update_chat_settings(self, chat_id, **values):
+        await database.update_chat_settings(self.db, chat_id, **values)
+
+    async def add_warning(self, user_id, chat_id, reason):
+        return await database.add_warning(self.db, user_id, chat_id, reason)
+
+    async def set_ban_status(self, user_id, chat_id, banned):
+        await database.set_ban_status(self.db, user_id, chat_id, banned)
+
+    async def increment_message_count(self, user_id, chat_id):
+        await database.increment_message_count(self.db, user_id, chat_id)
+
+    async def get_user_stats(self, user_id, chat_id):
+        return await database.get_user_stats(self.db, user_id, chat_id)
+
+    async def add_verified_user(self, user_id, chat_id):
+        await database.add_verified_user(self.db, user_id, chat_id)
+
+    async def is_verified_user(self, user_id, chat_id):
+        return await database.is_verified_user(self.db, user_id, chat_id)
+
+    async def get_auto_replies(self, chat_id):
+        return await database.get_auto_replies(self.db, chat_id)
+
+    async def add_auto_reply(self, chat_id, trigger, response):
+        await database.add_auto_reply(self.db, chat_id, trigger, response)
+        self.auto_reply_matchers.invalidate(chat_id)
+
+    async def remove_auto_reply(self, chat_id, trigger):
+        await database.remove_auto_reply(self.db, chat_id, trigger)
+        self.auto_reply_matchers.invalidate(chat_id)
+
+    async def save_poll(self, msg_id, poll_data):
+        await database.save_poll(self.db, msg_id, poll_data)
+
+    async def add_poll_vote(self, msg_id, user_id, option_index):
+        return await database.add_poll_vote(self.db, msg_id, user_id, option_index)
+
+    async def delete_poll(self, msg_id):
+        await database.delete_poll(self.db, msg_id)
+
+    def load_polls(self):
+        return database.load_polls(self.db)
+
+    async def mark_chat_departed(self, chat_id, left_at):
+        await database.mark_chat_departed(self.db, chat_id, left_at)
+
+    async def mark_chat_active(self, chat_id):
+        await database.mark_chat_active(self.db, chat_id)
+
+    async def purge_expired_warnings(self, cutoff, batch_size):
+        return await database.purge_expired_warnings(self.db, cutoff, batch_size)
+
+    async def purge_departed_chats(self, cutoff, batch_size):
+        deleted = await database.purge_departed_chats(self.db, cutoff, batch_size)
+        if deleted:
+            self.auto_reply_matchers.clear()
+        return deleted
+
+    async def purge_stale_polls(self, cutoff, batch_size):
+        return await database.purge_stale_polls(self.db, cutoff, batch_size)
+
+    async def get_toxicity_verdict(self, fingerprint, now):
+        return await database.get_toxicity_verdict(self.db, fingerprint, now)
+
+    async def save_toxicity_verdict(self, fingerprint, toxic, expires_at):
+        await database.save_toxicity_verdict(self.db, fingerprint, toxic, expires_at)
+
+    async def purge_expired_verdicts(self, now, batch_size):
+        return await database.purge_expired_verdicts(self.db, now, batch_size)
+
+    async def get_ask_response(self, key, now):
+        return await database.get_ask_response(self.db, key, now)
+
+    async def save_ask_response(self, key, response, expires_at):
+        await database.save_ask_response(self.db, key, response, expires_at)
+
+    async def purge_expired_ask_responses(self, now, batch_size):
+        return await database.purge_expired_ask_responses(self.db, now, batch_size)
+
+    async def clear_ask_responses(self, batch_size):
+        return await database.clear_ask_responses(self.db, batch_size)
+
+    async def take_welcome_template(self, language):
+        return await database.take_welcome_template(self.db, language)
+
+    async def add_global_bans(self, entries):
+        await database.add_global_bans(self.db, entries)
+
+    async def remove_global_ban(self, user_id):
+        return await database.remove_global_ban(self.db, user_id)
+
+    async def is_globally_banned(self, user_id):
+        return await database.is_globally_banned(self.db, user_id)
+
+    async def get_global_ban_ids(self):
+        return await database.get_global_ban_ids(self.db)
+
+    async def get_global_bans(self):
+        return await database.get_global_bans(self.db)
+
+    async def add_welcome_templates(self, language, templates):
+        await database.add_welcome_templates(self.db, language, templates)
+
+    async def count_welcome_templates(self, language):
+        return await database.count_welcome_templates(self.db, language)
+
+    async def compact(self, pages):
+        return await database.compact(self.db, pages)
+
+    async def backup(self, path, pages, sleep):
+        await database.backup(self.db, path, pages, sleep)
+
+class MemoryStorage(Storage):
+    def __init__(self):
+        super().__init__()
+        self.settings = {}
+        self.warnings = {}
+        self.message_counts = defaultdict(int)
+        self.verified = set()
+        self.auto_replies = defaultdict(dict)
+        self.polls = {}
+        self.departed = {}
+        self.welcome_templates = defaultdict(list)
+        self.global_bans = {}
+
+    async def get_chat_settings(self, chat_id):
+        return self.settings.get(chat_id, CHAT_SETTINGS_DEFAULTS)
+
+    async def update_chat_settings(self, chat_id, **values):
+        settings = dict(self.settings.get(chat_id, CHAT_SETTINGS_DEFAULTS))
+        settings.update((key, value) for key, value in values.items() if key in CHAT_SETTINGS_DEFAULTS)
+        self.settings[chat_id] = settings
+
+    async def add_warning(self, user_id, chat_id, reason):
+        warning = self.warnings.setdefault((chat_id, user_id), {'count': 0, 'banned': False, 'last_warn': None})
+        warning['count'] += 1
+        warning['last_warn'] = datetime.now()
+        return warning['count'], warning['banned']
+
+    async def set_ban_status(self, user_id, chat_id, banned):
+        warning = self.warnings.setdefault((chat_id, user_id), {'count': 0, 'banned': False, 'last_warn': None})
+        warning['banned'] = banned
+        warning['last_warn'] = datetime.now()
+
+    async def increment_message_count(self, user_id, chat_id):
+        self.message_counts[(chat_id, user_id)] += 1
+
+    async def get_user_stats(self, user_id, chat_id):
+        warning = self.warnings.get((chat_id, user_id), {'count': 0, 'banned': False})
+        return self.message_counts.get((chat_id, user_id), 0), warning['count'], bool(warning['banned'])
+
+    async def add_verified_user(self, user_id, chat_id):
+        self.verified.add((chat_id, user_id))
+
+    async def is_verified_user(self, user_id, chat_id):
+        return (chat_id, user_id) in self.verified
+
+    async def get_auto_replies(self, chat_id):
+        return dict(self.auto_replies.get(chat_id, {}))
+
+    async def add_auto_reply(self, chat_id, trigger, response):
+        self.auto_replies[chat_id][normalize_trigger(trigger)] = response
+        self.auto_reply_matchers.invalidate(chat_id)
+
+    async def remove_auto_reply(self, chat_id, trigger):
+        self.auto_replies[chat_id].pop(normalize_trigger(trigger), None)
+        self.auto_reply_matchers.invalidate(chat_id)
+
+    async def save_poll(self, msg_id, poll_data):
+        votes = self.polls.get(msg_id, {}).get('votes', {})
+        self.polls[msg_id] = {key: poll_data[key] for key in ('chat_id', 'question', 'options', 'created_at')}
+        self.polls[msg_id]['votes'] = votes
+
+    async def add_poll_vote(self, msg_id, user_id, option_index):
+        votes = self.polls.setdefault(msg_id, {'votes': {}})['votes']
+        if user_id in votes:
+            return False
+        votes[user_id] = option_index
+        return True
+
+    async def delete_poll(self, msg_id):
+        self.polls.pop(msg_id, None)
+
+    def load_polls(self):
+        polls = {}
+        for msg_id, poll in self.polls.items():
+            if 'question' not in poll:
+                continue
+            votes = defaultdict(int)
+            for option_index in poll['votes'].values():
+                votes[option_index] += 1
+            polls[msg_id] = dict(poll, votes=votes, voters=set(poll['votes']))
+        return polls
+
+    async def mark_chat_departed(self, chat_id, left_at):
+        self.departed[chat_id] = left_at
+
+    async def mark_chat_active(self, chat_id):
+        self.departed.pop(chat_id, None)
+
+    async def purge_expired_warnings(self, cutoff, batch_size):
+        expired = [key for key, warning in self.warnings.items() if not warning['banned'] and warning['last_warn'] < cutoff]
+        for key in expired:
+            del self.warnings[key]
+        return len(expired)
+
+    async def purge_departed_chats(self, cutoff, batch_size):
+        deleted = 0
+        for chat_id in [chat_id for chat_id, left_at in self.departed.items() if left_at < cutoff]:
+            deleted += int(self.settings.pop(chat_id, None) is not None) + len(self.auto_replies.pop(chat_id, {}))
+            for store in (self.warnings, self.message_counts):
+                keys = [key for key in store if key[0] == chat_id]
+                for key in keys:
+                    del store[key]
+                deleted += len(keys)
+            verified = {key for key in self.verified if key[0] == chat_id}
+            self.verified -= verified
+            polls = [msg_id for msg_id, poll in self.polls.items() if poll.get('chat_id') == chat_id]
+            for msg_id in polls:
+                del self.polls[msg_id]
+            deleted += len(verified) + len(polls)
+            del self.departed[chat_id]
+            self.auto_reply_matchers.invalidate(chat_id)
+        return deleted
+
+    async def purge_stale_polls(self, cutoff, batch_size):
+        stale = [msg_id for msg_id, poll in self.polls.items() if poll.get('created_at', 0) < cutoff]
+        for msg_id in stale:
+            del self.polls[msg_id]
+        return len(stale)
+
+    async def take_welcome_template(self, language):
+        templates = self.welcome_templates[language]
+        return templates.pop(random.randrange(len(templates))) if templates else None
+
+    async def add_welcome_templates(self, language, templates):
+        self.welcome_templates[language].extend(templates)
+
+    async def count_welcome_templates(self, language):
+        return len(self.welcome_templates[language])
+
+    async def add_global_bans(self, entries):
+        for user_id, reason, banned_by, banned_at in entries:
+            self.global_bans[user_id] = (user_id, reason, banned_by, banned_at)
+
+    async def remove_global_ban(self, user_id):
+        return self.global_bans.pop(user_id, None) is not None
+
+    async def is_globally_banned(self, user_id):
+        return user_id in self.global_bans
+
+    async def get_global_ban_ids(self):
+        return list(self.global_bans)
+
+    async def get_global_bans(self):
+        return sorted(self.global_bans.values(), key=lambda ban: ban[3])
+
+def create_storage(backend=STORAGE_BACKEND, path=DATABASE_PATH):
+    if backend == "memory":
+        logger.info("Using in-memory storage")
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SQLiteStorage(Database(path))
+    raise ValueError(f"Unknown storage backend: {backend}")
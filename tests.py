@@ -1,5 +1,37 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
 import unittest
-from ai import sanitize_input, is_hindi
+from unittest import mock
+import ai
+from aiohttp import web
+from ai import sanitize_input, is_hindi, ToxicityBatcher, parse_batch_response, ask_deepseek, stream_deepseek, SingleFlight
+from database import Database, QueryStats, set_welcome_message, get_welcome_message, is_auto_management_enabled
+from database import increment_message_count, get_user_stats, toggle_welcome, is_welcome_enabled
+from database import add_warning, set_ban_status
+from database import save_poll, add_poll_vote, delete_poll, load_polls
+from database import mark_chat_departed, purge_expired_warnings, purge_departed_chats, compact
+from storage import SQLiteStorage, MemoryStorage
+from backup import run_backup
+from flood import FloodLimiter
+from matcher import AutoReplyMatcher, check_regex
+import re
+from toxicity import ToxicityPrefilter, CLEAN, AMBIGUOUS, TOXIC
+from pipeline import ModerationPipeline, HIGH, NORMAL
+from joins import JoinCoalescer
+from spam import SpamIndex, minhash, similarity
+import random
+from admins import AdminCache
+from welcomes import WelcomePool
+from limiter import AdaptiveLimiter, INTERACTIVE, BACKGROUND
+from bans import BloomFilter, GlobalBanList, parse_ban_list, format_ban_list
+from types import SimpleNamespace
+import gzip
+import sqlite3
+from datetime import datetime, timedelta
 
 class TestBot(unittest.TestCase):
     def test_sanitize_input(self):
@@ -10,5 +42,588 @@ class TestBot(unittest.TestCase):
         self.assertTrue(is_hindi("हेलो"))
         self.assertFalse(is_hindi("Hello"))
 
+    def test_flood_limiter(self):
+        limiter = FloodLimiter(max_keys=3, idle_after=60)
+        self.assertEqual([limiter.hit(1, 1, 5, 30, now=t) for t in range(6)], [False] * 5 + [True])
+        self.assertFalse(limiter.hit(1, 1, 5, 30, now=40))
+        self.assertTrue(limiter.hit(2, 1, 1, 10, now=40) is False and limiter.hit(2, 1, 1, 10, now=41))
+        for user_id in range(3, 6):
+            limiter.hit(user_id, 1, now=50)
+        self.assertEqual(len(limiter), 3)
+        self.assertEqual(limiter.sweep(now=111), 3)
+
+    def test_auto_reply_matcher(self):
+        matcher = AutoReplyMatcher({"he": "HE", "she": "SHE", "word:cat": "CAT", "re:\\d{3}-\\d{4}": "PHONE"})
+        self.assertEqual(matcher.match("Ushers"), "SHE")
+        self.assertIsNone(matcher.match("concatenate"))
+        self.assertEqual(matcher.match("my CAT!"), "CAT")
+        self.assertEqual(matcher.match("call 555-1234 then he"), "PHONE")
+        self.assertFalse(AutoReplyMatcher({}))
+
+    def test_regex_triggers_are_bounded(self):
+        for pattern in ("(a+)+$", "(a|aa)*b", "(\\w+\\s?)+$", ".*.*x", "a" * 101, ""):
+            with self.assertRaises(re.error):
+                check_regex(pattern)
+        for pattern in ("\\d{3}-\\d{4}", "\\bbuy\\b.*\\bnow\\b", "[*+]+x", "(?:hi|hello) there"):
+            check_regex(pattern)
+        # Hostile triggers stored before validation are skipped, and scans stop at the text cap
+        matcher = AutoReplyMatcher({"re:(a+)+$": "FROZEN", "re:a+b": "AB"})
+        start = time.perf_counter()
+        self.assertIsNone(matcher.match("a" * 100000 + "b"))
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_toxicity_prefilter(self):
+        prefilter = ToxicityPrefilter()
+        self.assertEqual(prefilter.classify("hello everyone, how are you?", 1)[0], CLEAN)
+        self.assertEqual(prefilter.classify("you are a f u c k i n g idiot", 1)[0], TOXIC)
+        self.assertEqual(prefilter.classify("तू चूत\u200dिया है", 1)[0], TOXIC)
+        self.assertEqual(prefilter.classify("$tup1d", 1)[0], AMBIGUOUS)
+        self.assertEqual(prefilter.classify("$tup1d", 2, clean_below=0.6)[0], CLEAN)
+        self.assertEqual(prefilter.classify("classic washoles", 2)[0], CLEAN)
+        self.assertEqual(prefilter.stats(1)['escalated'], 1)
+        self.assertEqual(prefilter.stats()['checked'], 6)
+        for text in ("Skill yourself up before the interview", "Moby Dick headphones", "We hit the mother lode",
+                     "Randi Zuckerberg spoke today", "bc I was late", "that was a fucking great game"):
+            self.assertNotEqual(prefilter.classify(text, 3)[0], TOXIC, text)
+        self.assertEqual(prefilter.classify("you motherfucking bitch", 3)[0], TOXIC)
+
+    def test_deepseek_client_reuses_connections(self):
+        async def run():
+            peers = []
+            async def completions(request):
+                peers.append(request.transport.get_extra_info('peername'))
+                return web.json_response({'choices': [{'message': {'content': ' Hello '}}]})
+            app = web.Application()
+            app.router.add_post('/v1/chat/completions', completions)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            client = ai.DeepSeekClient(url=f"http://127.0.0.1:{port}/v1/chat/completions")
+            client.start()
+            try:
+                with mock.patch('ai.deepseek', client):
+                    answers = [await ask_deepseek("Hi"), await ask_deepseek("Hi again")]
+            finally:
+                await client.close()
+                await runner.cleanup()
+            return answers, len(set(peers)), client.session
+        self.assertEqual(asyncio.run(run()), (["Hello", "Hello"], 1, None))
+
+    def test_stream_deepseek(self):
+        async def run():
+            async def completions(request):
+                payload = await request.json()
+                assert payload['stream']
+                response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+                await response.prepare(request)
+                for delta in ({'role': 'assistant'}, {'content': 'Hel'}, {'content': 'lo'}, {'content': ' world'}):
+                    await response.write(f"data: {json.dumps({'choices': [{'delta': delta}]})}\n\n".encode())
+                # "Cut" simulates a dropped connection
+                if payload['messages'][0]['content'] != "Cut":
+                    await response.write(b"data: [DONE]\n\n")
+                return response
+            app = web.Application()
+            app.router.add_post('/v1/chat/completions', completions)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            client = ai.DeepSeekClient(url=f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/v1/chat/completions")
+            shown = []
+            async def on_text(partial):
+                shown.append(partial)
+            try:
+                with mock.patch('ai.deepseek', client):
+                    throttled = await stream_deepseek("Hi", on_text, interval=60)
+                    unthrottled = await stream_deepseek("Hi", on_text, interval=0)
+                    storage = MemoryStorage()
+                    truncated = await storage.ask_cached("Cut", lambda question: stream_deepseek(question, on_text, interval=60))
+                    cached = storage.ask_responses.entries
+            finally:
+                await client.close()
+                await runner.cleanup()
+            return throttled, unthrottled, shown, truncated, cached
+        self.assertEqual(asyncio.run(run()), ("Hello world", "Hello world", ["Hel", "Hel", "Hello", "Hello world", "Hel"],
+                                              ai.API_ERROR, {}))
+
+    def test_single_flight(self):
+        calls = []
+        async def slow(question):
+            calls.append(question)
+            await asyncio.sleep(0.05)
+            return f"Answer to {question}"
+        async def run():
+            flights = SingleFlight()
+            waiters = [asyncio.create_task(flights.do("q", slow, "q")) for _ in range(3)]
+            other = asyncio.create_task(flights.do("other", slow, "other"))
+            await asyncio.sleep(0.01)
+            waiters[0].cancel()
+            results = await asyncio.gather(*waiters[1:], other)
+            return results, waiters[0].cancelled(), flights.stats()
+        results, cancelled, stats = asyncio.run(run())
+        self.assertEqual(results, ["Answer to q", "Answer to q", "Answer to other"])
+        self.assertTrue(cancelled)
+        self.assertEqual(sorted(calls), ["other", "q"])
+        self.assertEqual((stats['calls'], stats['coalesced'], stats['in_flight']), (4, 2, 0))
+
+    def test_adaptive_limiter(self):
+        async def run():
+            limiter = AdaptiveLimiter(initial=1, max_limit=4, latency_target=10, interactive_weight=2)
+            order = []
+            async def request(chat_id, lane):
+                async with limiter.slot(chat_id, lane) as slot:
+                    order.append(chat_id)
+                    await asyncio.sleep(0)
+                    slot.record(200)
+            blocker = await limiter.acquire()
+            tasks = [asyncio.create_task(request(chat_id, lane)) for chat_id, lane in
+                     [(1, BACKGROUND)] * 3 + [(2, BACKGROUND), (3, INTERACTIVE), (4, INTERACTIVE), (4, INTERACTIVE)]]
+            await asyncio.sleep(0)
+            cancelled = tasks.pop(2)
+            cancelled.cancel()
+            limiter.release()
+            await asyncio.gather(*tasks)
+            raised = limiter.limit
+            # One overload round halves the limit once, however many requests in it fail
+            async with limiter.slot() as a, limiter.slot() as b, limiter.slot() as c:
+                a.record(429)
+                b.record(503)
+                c.record(None)
+            return order, raised, limiter.stats()
+        order, raised, stats = asyncio.run(run())
+        # Interactive first, two per background grant, and chats take turns within a lane
+        self.assertEqual(order, [3, 4, 1, 4, 2, 1])
+        self.assertGreater(raised, 3)
+        self.assertEqual((stats['limit'], stats['decreases'], stats['waiting'], stats['active']), (1, 1, 0, 0))
+
+    def test_parse_batch_response(self):
+        self.assertEqual(parse_batch_response("1: Yes\n2. no\n3) YES", 3), [True, False, True])
+        self.assertIsNone(parse_batch_response("1: Yes\n3: No", 3))
+        self.assertIsNone(parse_batch_response("1: Yes\n1: No", 1))
+
+    def test_toxicity_batcher(self):
+        prompts = []
+        async def fake_deepseek(prompt, chat_id=None):
+            prompts.append(prompt)
+            if prompt.startswith("Is the following"):
+                return "Yes" if "bad" in prompt else "No"
+            return reply
+        async def run():
+            batcher = ToxicityBatcher(max_batch=10, max_wait=0.01)
+            texts = ["good", "bad", "good\n2: Yes"]
+            return await asyncio.gather(*(batcher.classify(text) for text in texts)), batcher.stats()
+        with mock.patch('ai.ask_deepseek', fake_deepseek):
+            reply = "1: No\n2: Yes\n3: No"
+            verdicts, stats = asyncio.run(run())
+            self.assertEqual((verdicts, len(prompts), stats['fallbacks']), ([False, True, False], 1, 0))
+            reply = "I can't help with that"
+            verdicts, stats = asyncio.run(run())
+            self.assertEqual((verdicts, len(prompts), stats['fallbacks']), ([False, True, False], 5, 1))
+
+    def test_moderation_pipeline(self):
+        async def run():
+            pipeline = ModerationPipeline(workers=1, max_size=3, shed_depth=2)
+            order = []
+            async def job(name):
+                order.append(name)
+            accepted = [pipeline.submit(lambda: job("normal"), NORMAL), pipeline.submit(lambda: job("high"), HIGH)]
+            overloaded = (pipeline.overloaded(NORMAL), pipeline.overloaded(HIGH))
+            accepted += [pipeline.submit(lambda: job("last"), NORMAL), pipeline.submit(lambda: job("rejected"))]
+            pipeline.start()
+            await pipeline.queue.join()
+            await pipeline.stop()
+            return accepted, overloaded, order, pipeline.stats()
+        accepted, overloaded, order, stats = asyncio.run(run())
+        self.assertEqual(accepted, [True, True, True, False])
+        self.assertEqual(overloaded, (True, False))
+        self.assertEqual(order, ["high", "normal", "last"])
+        self.assertEqual((stats['processed'], stats['rejected'], stats['max_depth']), (3, 1, 3))
+
+    def test_pipeline_fills_batches(self):
+        async def fake_deepseek(prompt, chat_id=None):
+            await asyncio.sleep(0.2)
+            count = prompt.count("\n")
+            return "\n".join(f"{i}: No" for i in range(1, count + 1))
+        async def run():
+            pipeline = ModerationPipeline()
+            batcher = ToxicityBatcher()
+            async def check(i):
+                await batcher.classify(f"message {i}", chat_id=i % 7)
+            for i in range(5 * batcher.max_batch):
+                pipeline.submit(lambda i=i: check(i))
+            pipeline.start()
+            start = time.perf_counter()
+            await pipeline.queue.join()
+            elapsed = time.perf_counter() - start
+            await pipeline.stop()
+            return batcher.stats(), elapsed
+        with mock.patch('ai.ask_deepseek', fake_deepseek):
+            stats, elapsed = asyncio.run(run())
+        # Default workers keep every batch full, and the batches run concurrently
+        self.assertEqual((stats['requests'], stats['batch_size']), (5, ToxicityBatcher().max_batch))
+        self.assertLess(elapsed, 0.6)
+
+    def test_shed_checks_never_punish(self):
+        # ui.py can't be imported here, so the moderation handlers get a stand-in keyboard helper
+        with mock.patch.dict(sys.modules, ui=SimpleNamespace(create_keyboard=lambda buttons: None)):
+            import moderation
+        handlers = {}
+        client = SimpleNamespace(on_message=lambda _: lambda handler: handlers.setdefault(handler.__name__, handler))
+        storage = MemoryStorage()
+        moderation.register_moderation_handlers(client, storage)
+        texts = ["Moby Dick headphones", "that was a fucking great game", "this homework is stupid"]
+        messages = [SimpleNamespace(text=text, chat=SimpleNamespace(id=-100), from_user=SimpleNamespace(id=i),
+                                    delete=mock.AsyncMock(), reply=mock.AsyncMock()) for i, text in enumerate(texts)]
+        async def run():
+            for message in messages:
+                await handlers['moderate_message'](None, message)
+        with mock.patch.object(moderation.moderation_pipeline, 'overloaded', return_value=True):
+            shed = moderation.moderation_pipeline.shed['local']
+            asyncio.run(run())
+        self.assertEqual(moderation.moderation_pipeline.shed['local'] - shed, 3)
+        self.assertEqual([message.delete.await_count for message in messages], [0, 0, 0])
+        self.assertEqual(storage.warnings, {})
+
+    def test_join_coalescer(self):
+        async def run():
+            sent = []
+            async def send(chat_id, members):
+                sent.append((chat_id, members, time.monotonic()))
+            joins = JoinCoalescer(window=0.02, min_interval=0.1, raid_joins=6, raid_window=60, raid_duration=60)
+            started = time.monotonic()
+            raids = [joins.add(1, ["a"], send), joins.add(1, ["b", "c"], send), joins.add(2, ["x"], send)]
+            await asyncio.sleep(0.05)
+            raids.append(joins.add(1, ["d"], send))
+            await asyncio.sleep(0.15)
+            raids += [joins.add(1, ["e", "f"], send), joins.add(1, ["g"], send)]
+            await asyncio.sleep(0.15)
+            return raids, [(chat_id, members) for chat_id, members, _ in sent], sent[2][2] - started, joins.in_raid(1)
+        raids, sent, second_welcome_at, in_raid = asyncio.run(run())
+        self.assertEqual(raids, [False, False, False, False, True, False])
+        self.assertEqual(sent, [(1, ["a", "b", "c"]), (2, ["x"]), (1, ["d"])])
+        self.assertGreaterEqual(second_welcome_at, 0.1)
+        self.assertTrue(in_raid)
+
+    def test_spam_index(self):
+        index = SpamIndex(chats=3, window=600, threshold=0.6, min_tokens=6)
+        spam = "Join our crypto pump group now and earn 500 dollars daily, guaranteed profit!"
+        variants = [spam, spam.upper().replace("500", "700"), "hey " + spam.replace("now", "today")]
+        self.assertEqual([index.is_spam(text, chat_id, now=chat_id) for chat_id, text in enumerate(variants)], [False, False, True])
+        self.assertEqual(index.observe(spam, 7, now=2), 4)
+        self.assertEqual(index.observe("Join my football club today and win free match tickets", 8, now=3), 1)
+        self.assertEqual(index.observe("good morning", 9, now=3), 0)
+        self.assertEqual(index.observe(spam, 10, now=700), 1)
+        self.assertEqual(len(index), 1)
+
+    def test_spam_index_short_messages(self):
+        # Short messages leave most MinHash bins empty; those must neither match nor share a bucket
+        rng = random.Random(1)
+        words = [''.join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 4))) for _ in range(5000)]
+        index = SpamIndex(chats=3, window=10**9, threshold=0.6, min_tokens=6)
+        for i in range(2000):
+            index.observe(" ".join(rng.choices(words, k=6)), i, now=i)
+        self.assertEqual(len(index), 2000)
+        self.assertLess(max(len(bucket) for bucket in index.buckets.values() if not isinstance(bucket, int)), 10)
+        self.assertLess(similarity(minhash("ab cd ef gh ij kl"), minhash("mn op qr st uv wx")), 0.2)
+
+    def test_admin_cache(self):
+        class FakeClient:
+            calls = 0
+            admins = [1, 2]
+            async def iter_chat_members(self, chat_id, filter):
+                self.calls += 1
+                await asyncio.sleep(0.01)
+                for user_id in list(self.admins):
+                    yield SimpleNamespace(user=SimpleNamespace(id=user_id))
+        async def run():
+            client, cache = FakeClient(), AdminCache(ttl=60)
+            checks = await asyncio.gather(*(cache.is_admin(client, -100, user_id) for user_id in (1, 2, 3)))
+            checks.append(await cache.is_admin(client, -100, 3))
+            client.admins.append(3)
+            cache.invalidate(-100)
+            checks.append(await cache.is_admin(client, -100, 3))
+            return checks, client.calls
+        self.assertEqual(asyncio.run(run()), ([True, True, False, False, True], 2))
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=10000, fp_rate=0.01)
+        for user_id in range(0, 20000, 2):
+            bloom.add(user_id)
+        self.assertTrue(all(user_id in bloom for user_id in range(0, 20000, 2)))
+        self.assertLess(sum(user_id in bloom for user_id in range(1, 20000, 2)), 250)
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmp.name, 'test.db'))
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def test_wal_mode(self):
+        self.assertEqual(self.db.fetchone("PRAGMA journal_mode")[0], "wal")
+
+    def test_async_helpers(self):
+        async def run():
+            await set_welcome_message(self.db, 1, "Welcome {name}!", "https://example.com/a.jpg")
+            return await get_welcome_message(self.db, 1), await is_auto_management_enabled(self.db, 1)
+        self.assertEqual(asyncio.run(run()), (("Welcome {name}!", "https://example.com/a.jpg"), True))
+
+    def test_concurrent_warnings(self):
+        self.db.query_stats = QueryStats(slow_query_ms=1000)
+        async def run():
+            counts = await asyncio.gather(*(add_warning(self.db, 7, 1, "spam") for _ in range(10)))
+            await set_ban_status(self.db, 7, 1, True)
+            return sorted(count for count, _ in counts), await get_user_stats(self.db, 7, 1)
+        self.assertEqual(asyncio.run(run()), (list(range(1, 11)), (0, 10, True)))
+        upserts = [stat for stat in self.db.query_stats.snapshot() if "RETURNING count" in stat['query']]
+        self.assertEqual((upserts[0]['calls'], upserts[0]['rows']), (10, 10))
+        # Errors are logged like every other write instead of reaching the handler
+        self.db.execute("DROP TABLE warnings")
+        with self.assertLogs('database', 'ERROR'):
+            self.assertEqual(asyncio.run(add_warning(self.db, 7, 1, "spam")), (0, False))
+
+    def test_buffered_message_counts(self):
+        async def run():
+            for _ in range(3):
+                await increment_message_count(self.db, 7, 1)
+            before_flush = await get_user_stats(self.db, 7, 1)
+            await self.db.stats_buffer.flush()
+            await increment_message_count(self.db, 7, 1)
+            return before_flush, self.db.fetchone("SELECT message_count FROM user_stats")[0], await get_user_stats(self.db, 7, 1)
+        self.assertEqual(asyncio.run(run()), ((3, 0, False), 3, (4, 0, False)))
+
+    def test_settings_cache_invalidation(self):
+        async def run():
+            first = await is_welcome_enabled(self.db, 1)
+            await toggle_welcome(self.db, 1, False)
+            return first, await is_welcome_enabled(self.db, 1), 1 in self.db.settings_cache.entries
+        self.assertEqual(asyncio.run(run()), (True, False, True))
+
+    def test_settings_migration(self):
+        self.db.execute("INSERT INTO welcome_toggles VALUES (5, 0)")
+        self.db.execute("INSERT INTO goodbye_messages VALUES (5, 'Bye {name}')")
+        self.db.execute("PRAGMA user_version = 0")
+        self.db.init_tables()
+        row = self.db.fetchone("SELECT * FROM chat_settings WHERE chat_id=5")
+        self.assertEqual((row['welcome_enabled'], row['auto_management'], row['goodbye_message']), (0, 1, 'Bye {name}'))
+
+    def test_query_stats(self):
+        stats = QueryStats(slow_query_ms=1000)
+        self.assertEqual(stats.normalize("SELECT 1 FROM t WHERE id IN (1, 2, 3) AND name='x'"),
+                         "SELECT ? FROM t WHERE id IN (?, ...) AND name=?")
+        self.db.query_stats = stats
+        self.db.fetchall("SELECT * FROM chat_settings WHERE chat_id=?", (1,))
+        self.db.fetchall("SELECT * FROM chat_settings WHERE chat_id=?", (2,))
+        snapshot = stats.snapshot()[0]
+        self.assertEqual((snapshot['query'], snapshot['calls'], snapshot['rows']), ("SELECT * FROM chat_settings WHERE chat_id=?", 2, 0))
+
+    def test_poll_votes(self):
+        async def run():
+            await save_poll(self.db, 10, {'chat_id': 1, 'question': 'Q?', 'options': ['a', 'b'], 'created_at': 0.0})
+            return [await add_poll_vote(self.db, 10, user_id, option) for user_id, option in [(1, 0), (2, 1), (1, 1)]]
+        self.assertEqual(asyncio.run(run()), [True, True, False])
+        poll = load_polls(self.db)[10]
+        self.assertEqual((dict(poll['votes']), poll['voters']), ({0: 1, 1: 1}, {1, 2}))
+        asyncio.run(delete_poll(self.db, 10))
+        self.assertIsNone(self.db.fetchone("SELECT 1 FROM poll_tallies"))
+
+    def test_poll_migration(self):
+        self.db.execute("INSERT INTO polls VALUES (11, 1, 'Q?', '[\"a\", \"b\"]', '{\"1\": 2}', '[5, 6]', 0)")
+        self.db.execute("PRAGMA user_version = 1")
+        self.db.init_tables()
+        poll = load_polls(self.db)[11]
+        self.assertEqual((dict(poll['votes']), poll['voters']), ({1: 2}, {5, 6}))
+
+    def test_retention(self):
+        async def run():
+            old = datetime.now() - timedelta(days=60)
+            self.db.executemany("INSERT INTO warnings VALUES (?, ?, 1, ?, ?)", [(1, u, old, u == 0) for u in range(25)])
+            await toggle_welcome(self.db, 2, False)
+            await mark_chat_departed(self.db, 2, 0)
+            warnings = await purge_expired_warnings(self.db, datetime.now() - timedelta(days=30), 10)
+            chat_rows = await purge_departed_chats(self.db, 100, 10)
+            return warnings, chat_rows, await is_welcome_enabled(self.db, 2), await compact(self.db, 100) >= 0
+        self.assertEqual(asyncio.run(run()), (24, 1, True, True))
+        self.assertEqual(self.db.fetchone("SELECT COUNT(*) FROM warnings")[0], 1)
+
+    def test_auto_vacuum_conversion(self):
+        self.db.close()
+        path = os.path.join(self.tmp.name, 'legacy.db')
+        legacy = sqlite3.connect(path)
+        legacy.execute("CREATE TABLE verified_users (chat_id INTEGER, user_id INTEGER, PRIMARY KEY (chat_id, user_id))")
+        legacy.executemany("INSERT INTO verified_users VALUES (?, ?)", [(1, u) for u in range(20000)])
+        legacy.commit()
+        legacy.close()
+        self.db = Database(path)
+        self.db.execute("DELETE FROM verified_users")
+        self.assertEqual(self.db.fetchone("PRAGMA auto_vacuum")[0], 2)
+        self.assertGreater(asyncio.run(compact(self.db, 1000)), 0)
+
+    def test_backup(self):
+        self.db.execute("INSERT INTO verified_users VALUES (1, 2)")
+        backups = os.path.join(self.tmp.name, 'backups')
+        for _ in range(3):
+            report = asyncio.run(run_backup(SQLiteStorage(self.db), backups, keep=2))
+        self.assertEqual(len(os.listdir(backups)), 2)
+        restored = os.path.join(self.tmp.name, 'restored.db')
+        with gzip.open(report['path'], 'rb') as f_in, open(restored, 'wb') as f_out:
+            f_out.write(f_in.read())
+        restored_db = Database(restored)
+        self.assertEqual(restored_db.fetchone("SELECT COUNT(*) FROM verified_users")[0], 1)
+        restored_db.close()
+
+    def test_backup_during_writes(self):
+        self.db.executemany("INSERT INTO verified_users VALUES (1, ?)", [(u,) for u in range(5000)])
+        path = os.path.join(self.tmp.name, 'snapshot.db')
+        async def run():
+            storage = SQLiteStorage(self.db)
+            async def write():
+                for u in range(5000, 5050):
+                    await self.db.aexecute("INSERT INTO verified_users VALUES (1, ?)", (u,))
+            await asyncio.gather(storage.backup(path, 1, 0.001), write())
+        asyncio.run(run())
+        copy = sqlite3.connect(path)
+        self.assertEqual(copy.execute("PRAGMA integrity_check").fetchone()[0], "ok")
+        self.assertIn(copy.execute("SELECT COUNT(*) FROM verified_users").fetchone()[0], range(5000, 5051))
+        copy.close()
+        self.assertEqual(self.db.fetchone("SELECT COUNT(*) FROM verified_users")[0], 5050)
+
+class TestStorage(unittest.TestCase):
+    async def exercise(self, storage):
+        await storage.toggle_welcome(1, False)
+        await storage.set_goodbye_message(1, "Bye {name}")
+        await storage.add_warning(7, 1, "spam")
+        count, _ = await storage.add_warning(7, 1, "spam")
+        await storage.set_ban_status(7, 1, True)
+        await storage.increment_message_count(7, 1)
+        await storage.add_verified_user(8, 1)
+        await storage.add_auto_reply(1, "Hello", "Hi!")
+        await storage.add_auto_reply(1, "bye", "Cya")
+        await storage.remove_auto_reply(1, "BYE")
+        await storage.save_poll(3, {'chat_id': 1, 'question': 'Q?', 'options': ['a', 'b'], 'created_at': 0.0})
+        voted = [await storage.add_poll_vote(3, 7, 1), await storage.add_poll_vote(3, 7, 0)]
+        settings = await storage.get_chat_settings(1)
+        poll = storage.load_polls()[3]
+        return (
+            settings['welcome_enabled'], settings['goodbye_message'], count,
+            await storage.get_user_stats(7, 1), await storage.is_verified_user(8, 1),
+            await storage.get_auto_replies(1), voted, dict(poll['votes']), poll['voters']
+        )
+
+    def test_auto_reply_matcher_invalidation(self):
+        async def run():
+            storage = MemoryStorage()
+            await storage.add_auto_reply(1, "Hello", "Hi!")
+            first = (await storage.get_auto_reply_matcher(1)).match("hello there")
+            await storage.add_auto_reply(1, "re:@\\S+", "No emails please")
+            await storage.remove_auto_reply(1, "hello")
+            return first, (await storage.get_auto_reply_matcher(1)).match("hello me@example.com")
+        self.assertEqual(asyncio.run(run()), ("Hi!", "No emails please"))
+
+    def test_toxicity_verdict_cache(self):
+        calls = []
+        async def classify(text):
+            calls.append(text)
+            return None if "timeout" in text else "spam" in text.lower()
+        async def run(storage):
+            return [await storage.classify_toxicity(text, classify)
+                    for text in ("Buy SPAM now 👍🏻", "buy  spam now 👍🏿👍🏿", "timeout", "timeout")]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.db')
+            storage = SQLiteStorage(Database(path))
+            storage.persist_verdicts = True
+            self.assertEqual(asyncio.run(run(storage)), [True, True, None, None])
+            self.assertEqual(len(calls), 3)
+            storage.db.close()
+            restarted = SQLiteStorage(Database(path))
+            restarted.persist_verdicts = True
+            asyncio.run(restarted.classify_toxicity("BUY SPAM NOW 👍", classify))
+            self.assertEqual(restarted.toxicity_verdicts.stats()['persisted_hits'], 1)
+            self.assertEqual(asyncio.run(restarted.purge_expired_verdicts(time.time() + 10**6, 100)), 1)
+            restarted.db.close()
+        self.assertEqual(len(calls), 3)
+
+    def test_ask_cache(self):
+        calls = []
+        async def ask(question):
+            calls.append(question)
+            return "AI service error." if "outage" in question else f"Answer to {question}"
+        async def run(storage):
+            answers = [await storage.ask_cached(question, ask)
+                       for question in ("What is  Python?", "what is python", "outage", "outage")]
+            return answers, storage.ask_responses.stats()['hits']
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.db')
+            storage = SQLiteStorage(Database(path))
+            answers, hits = asyncio.run(run(storage))
+            self.assertEqual(answers[:2], ["Answer to What is  Python?"] * 2)
+            self.assertEqual((hits, len(calls)), (1, 3))
+            storage.db.close()
+            restarted = SQLiteStorage(Database(path))
+            self.assertEqual(asyncio.run(restarted.ask_cached("WHAT IS PYTHON?", ask)), "Answer to What is  Python?")
+            self.assertEqual(restarted.ask_responses.stats()['persisted_hits'], 1)
+            self.assertEqual(asyncio.run(restarted.purge_ask_responses()), 1)
+            self.assertEqual(asyncio.run(restarted.ask_cached("what is python", ask)), "Answer to what is python")
+            restarted.db.close()
+        self.assertEqual(len(calls), 4)
+
+    def test_welcome_pool(self):
+        generated = []
+        failing = set()
+        async def fake_template(language):
+            generated.append(language)
+            return None if language in failing else f"{language} hi {{name}}"
+        async def run(storage):
+            pool = WelcomePool(low=2, target=3, interval=0)
+            fallback = await pool.take(storage, "en")
+            # A failing language is tried once per pass and doesn't hold up the others
+            failing.add("Hindi")
+            await pool.refill(storage)
+            first = [await storage.count_welcome_templates(language) for language in ("hi", "en")]
+            failing.clear()
+            await pool.refill(storage)
+            counts = [await storage.count_welcome_templates(language) for language in ("hi", "en")]
+            taken = await pool.take(storage, "en")
+            return fallback, first, counts, taken, await storage.count_welcome_templates("en"), pool.fallbacks
+        with mock.patch('welcomes.generate_welcome_template', fake_template), tempfile.TemporaryDirectory() as tmp:
+            sqlite = SQLiteStorage(Database(os.path.join(tmp, 'test.db')))
+            expected = ("👋 Welcome to the group, {name}! 🎉", [0, 3], [3, 3], "English hi {name}", 2, 1)
+            self.assertEqual(asyncio.run(run(sqlite)), expected)
+            sqlite.db.close()
+            self.assertEqual(asyncio.run(run(MemoryStorage())), expected)
+        self.assertEqual(generated, (["Hindi"] + ["English"] * 3 + ["Hindi"] * 3) * 2)
+
+    def test_global_bans(self):
+        csv_text = format_ban_list([(5, "spam, links", 1, 0.0)]) + "garbage\n-100123,bot\n"
+        async def run(storage):
+            bans = GlobalBanList(capacity=1000)
+            await storage.add_global_bans([(7, "old", 1, 0.0)])
+            await bans.load(storage)
+            added = await bans.add(storage, parse_ban_list(csv_text, 2))
+            checks = [await bans.is_banned(storage, user_id) for user_id in (7, 5, -100123, 8)]
+            removed = await bans.remove(storage, 7)
+            checks.append(await bans.is_banned(storage, 7))
+            exported = sorted(ban[:3] for ban in await storage.get_global_bans())
+            return added, checks, removed, bans.false_positives, exported
+        expected = (2, [True, True, True, False, False], True, 1, [(-100123, "bot", 2), (5, "spam, links", 2)])
+        with tempfile.TemporaryDirectory() as tmp:
+            sqlite = SQLiteStorage(Database(os.path.join(tmp, 'test.db')))
+            self.assertEqual(asyncio.run(run(sqlite)), expected)
+            sqlite.db.close()
+        self.assertEqual(asyncio.run(run(MemoryStorage())), expected)
+
+    def test_backends_agree(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sqlite = SQLiteStorage(Database(os.path.join(tmp, 'test.db')))
+            sqlite_result = asyncio.run(self.exercise(sqlite))
+            sqlite.db.close()
+        memory_result = asyncio.run(self.exercise(MemoryStorage()))
+        self.assertEqual(sqlite_result, memory_result)
+        self.assertEqual(memory_result, (False, "Bye {name}", 2, (1, 2, True), True, {"hello": "Hi!"}, [True, False], {1: 1}, {7}))
+
 if __name__ == '__main__':
     unittest.main()
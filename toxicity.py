@@ -0,0 +1,185 @@
+import re
+import time
+import hashlib
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict
+from matcher import AhoCorasick
+from config import TOXICITY_CLEAN_BELOW, TOXICITY_TOXIC_AT, TOXICITY_CACHE_SIZE, TOXICITY_CACHE_TTL
+
+CLEAN, AMBIGUOUS, TOXIC = "clean", "ambiguous", "toxic"
+
+STRONG, MEDIUM, MILD = 0.9, 0.5, 0.25
+
+# Terms are normalized the same way as messages, so list each spelling once. Romanized terms that are also
+# English words or names (lode, randi, bc, mc) are left out: they would remove innocent messages unseen.
+LEXICON = {
+    # English
+    "fuck": STRONG, "fucker": STRONG, "fucking": STRONG, "motherfucker": STRONG, "cunt": STRONG,
+    "bitch": STRONG, "asshole": STRONG, "bastard": STRONG, "whore": STRONG, "slut": STRONG,
+    "dickhead": STRONG, "kill yourself": STRONG, "kys": STRONG, "go die": STRONG,
+    "shit": MEDIUM, "bullshit": MEDIUM, "dick": MEDIUM, "idiot": MEDIUM, "moron": MEDIUM,
+    "retard": MEDIUM, "stupid": MEDIUM, "dumb": MEDIUM, "loser": MEDIUM, "shut up": MEDIUM,
+    "stfu": MEDIUM, "screw you": MEDIUM, "pathetic": MEDIUM, "ugly": MILD, "damn": MILD,
+    "crap": MILD, "hell": MILD, "sucks": MILD, "hate you": MILD,
+    # Romanized Hindi
+    "madarchod": STRONG, "behenchod": STRONG, "bhenchod": STRONG,
+    "chutiya": STRONG, "chutiye": STRONG, "bhosdike": STRONG, "bhosdi": STRONG, "gandu": STRONG,
+    "lavde": STRONG, "harami": MEDIUM, "haramkhor": MEDIUM,
+    "kamina": MEDIUM, "kamine": MEDIUM, "kutta": MEDIUM, "kutte": MEDIUM, "kutiya": STRONG,
+    "ullu": MILD, "pagal": MILD, "bakwas": MILD, "saala": MILD, "saale": MILD, "gadha": MILD,
+    # Devanagari
+    "मादरचोद": STRONG, "बहनचोद": STRONG, "भेनचोद": STRONG, "चूतिया": STRONG, "चुतिया": STRONG,
+    "भोसडीके": STRONG, "गांडू": STRONG, "रंडी": STRONG, "कुतिया": STRONG, "हरामी": MEDIUM,
+    "हरामखोर": MEDIUM, "कमीना": MEDIUM, "कमीने": MEDIUM, "कुत्ता": MEDIUM, "कुत्ते": MEDIUM,
+    "उल्लू": MILD, "पागल": MILD, "बकवास": MILD, "साला": MILD, "साले": MILD, "गधा": MILD,
+}
+
+SECOND_PERSON = {"you", "u", "ur", "your", "youre", "yourself", "urself", "tu", "tum", "tera", "teri", "tere", "tujhe",
+                 "तू", "तुम", "तेरा", "तेरी", "तेरे", "तुझे"}
+
+LEET = str.maketrans({'0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '8': 'b',
+                      '@': 'a', '$': 's', '!': 'i', '|': 'i', '+': 't'})
+INVISIBLE = dict.fromkeys(map(ord, '\u200b\u200c\u200d\u2060\ufeff\u00ad'))
+# Spelling variants: nukta dropped, chandrabindu folded into anusvara
+DEVANAGARI = {0x093C: None, 0x0901: '\u0902'}
+REPEATS = re.compile(r'(.)\1+')
+# Variation selectors and skin tones, so 👍🏻 and 👍🏿 fingerprint alike
+EMOJI_MODIFIERS = re.compile('[\ufe0e\ufe0f\U0001f3fb-\U0001f3ff]')
+EMOJI_RUNS = re.compile('([\u2600-\u27bf\U0001f000-\U0001faff])\\1+')
+PUNCTUATION = '.,;:?!"\'()[]{}<>-_*~`'
+
+def is_letter(ch):
+    # Devanagari vowel signs are combining marks, not alphanumerics
+    return ch.isalpha() or unicodedata.category(ch).startswith('M')
+
+def normalize_token(token):
+    token = token.strip(PUNCTUATION)
+    # Plain words (the common case) have nothing to translate or strip
+    if not token.isalpha():
+        if any(ch.isalpha() for ch in token):
+            token = token.translate(LEET)
+        token = ''.join(ch for ch in token if is_letter(ch))
+    return REPEATS.sub(r'\1', token)
+
+def tokenize(text):
+    text = unicodedata.normalize('NFKC', text).translate(INVISIBLE).translate(DEVANAGARI).lower()
+    tokens, letters = [], []
+    for raw in text.split():
+        token = normalize_token(raw)
+        if len(token) == 1:
+            # "f u c k" spells out a word one letter at a time
+            letters.append(token)
+            continue
+        if letters:
+            tokens.append(''.join(letters))
+            letters = []
+        if token:
+            tokens.append(token)
+    if letters:
+        tokens.append(''.join(letters))
+    return tokens
+
+class ToxicityPrefilter:
+    # Scores messages locally; only scores between the chat's two thresholds need the LLM
+    def __init__(self, lexicon=LEXICON):
+        terms = {}
+        for term, weight in lexicon.items():
+            key = ' '.join(tokenize(term))
+            terms[key] = max(weight, terms.get(key, 0))
+        self.terms = terms
+        self.automaton = AhoCorasick((f" {term} ", term) for term in terms)
+        # Obfuscations that glue letters into one word ("motherfucking") only match long strong terms, and only
+        # inside a single token: across word boundaries "Moby Dick headphones" would spell "dickhead"
+        self.squashed = AhoCorasick((term.replace(' ', ''), term) for term, weight in terms.items()
+                                    if weight >= STRONG and len(term) >= 7)
+        self.counters = defaultdict(Counter)
+
+    def evaluate(self, text):
+        # Returns (score, strong signals): strong terms, plus targeting "you" once a strong term is present
+        tokens = tokenize(text)
+        matched = {term for _, _, term in self.automaton.iter(f" {' '.join(tokens)} ")}
+        for token in tokens:
+            matched.update(term for _, _, term in self.squashed.iter(token))
+        score = sum(self.terms[term] for term in matched)
+        strong = sum(self.terms[term] >= STRONG for term in matched)
+        if SECOND_PERSON.intersection(tokens):
+            score += 0.2 if matched else 0.05
+            strong += strong > 0
+        letters = [ch for ch in text if ch.isalpha()]
+        if len(letters) >= 5 and sum(ch.isupper() for ch in letters) / len(letters) > 0.7:
+            score += 0.1
+        return round(min(score, 1.0), 2), strong
+
+    def score(self, text):
+        return self.evaluate(text)[0]
+
+    def classify(self, text, chat_id=None, clean_below=TOXICITY_CLEAN_BELOW, toxic_at=TOXICITY_TOXIC_AT):
+        # Messages are removed without the LLM only on two strong signals; one strong term alone may be a homograph
+        score, strong = self.evaluate(text)
+        if score >= toxic_at and strong >= 2:
+            verdict = TOXIC
+        elif score < clean_below:
+            verdict = CLEAN
+        else:
+            verdict = AMBIGUOUS
+        self.counters[chat_id][verdict] += 1
+        return verdict, score
+
+    def stats(self, chat_id=None):
+        # No chat_id gives the totals across all chats
+        if chat_id is None:
+            counts = sum(self.counters.values(), Counter())
+        else:
+            counts = self.counters.get(chat_id, Counter())
+        total = sum(counts.values())
+        return {
+            'checked': total,
+            CLEAN: counts[CLEAN],
+            TOXIC: counts[TOXIC],
+            'escalated': counts[AMBIGUOUS],
+            'escalation_rate': counts[AMBIGUOUS] / total if total else 0.0,
+        }
+
+def fingerprint(text):
+    text = unicodedata.normalize('NFKC', text).translate(INVISIBLE).casefold()
+    text = EMOJI_RUNS.sub(r'\1', EMOJI_MODIFIERS.sub('', text))
+    return hashlib.blake2b(' '.join(text.split()).encode(), digest_size=16).hexdigest()
+
+class VerdictCache:
+    # LRU of key -> (value, expires_at), bounded by entry count; also holds /ask answers
+    def __init__(self, max_size=TOXICITY_CACHE_SIZE, ttl=TOXICITY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = self.persisted_hits = self.misses = 0
+
+    def get(self, key, now=None):
+        now = time.time() if now is None else now
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, expires_at):
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.persisted_hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'persisted_hits': self.persisted_hits,
+            'misses': self.misses,
+            'hit_ratio': (self.hits + self.persisted_hits) / lookups if lookups else 0.0,
+        }
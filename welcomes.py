@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from ai import ai_limiter, generate_welcome_template
+from config import WELCOME_LANGUAGES, WELCOME_POOL_LOW, WELCOME_POOL_TARGET, WELCOME_POOL_INTERVAL, WELCOME_POOL_CHECK
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEMPLATES = {
+    "hi": "👋 {name}, ग्रुप में आपका स्वागत है! 🎉",
+    "en": "👋 Welcome to the group, {name}! 🎉",
+}
+
+class WelcomePool:
+    # Welcomes are served from stored templates; generation happens in the background, never on a join
+    def __init__(self, low=WELCOME_POOL_LOW, target=WELCOME_POOL_TARGET, interval=WELCOME_POOL_INTERVAL):
+        self.low = low
+        self.target = target
+        self.interval = interval
+        self.wake = asyncio.Event()
+        self.served = self.fallbacks = self.generated = 0
+
+    async def take(self, storage, language):
+        template = await storage.take_welcome_template(language)
+        self.wake.set()
+        if template is None:
+            self.fallbacks += 1
+            return DEFAULT_TEMPLATES.get(language, DEFAULT_TEMPLATES["en"])
+        self.served += 1
+        return template
+
+    async def refill(self, storage):
+        for language, name in WELCOME_LANGUAGES.items():
+            count = await storage.count_welcome_templates(language)
+            if count >= self.low:
+                continue
+            while count < self.target:
+                # Every API slot is in use or spoken for; wait rather than queue behind moderation and /ask
+                while ai_limiter.busy():
+                    await asyncio.sleep(1)
+                template = await generate_welcome_template(name)
+                await asyncio.sleep(self.interval)
+                if not template:
+                    # The API is failing; leave this language for the next pass instead of retrying it in a loop
+                    logger.warning(f"Welcome template generation failed for {name}; {count} stored")
+                    break
+                await storage.add_welcome_templates(language, [template])
+                count += 1
+                self.generated += 1
+
+    async def run(self, storage, check_interval=WELCOME_POOL_CHECK):
+        while True:
+            try:
+                await self.refill(storage)
+            except Exception as e:
+                logger.error(f"Welcome pool error: {e}")
+            try:
+                await asyncio.wait_for(self.wake.wait(), check_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+
+welcome_pool = WelcomePool()